@@ -0,0 +1,225 @@
+"""Vectorised adherence analytics over a user's consumption history.
+
+A history is loaded once into flat NumPy arrays (local epoch seconds,
+medication index, quantity and status code) and every statistic is computed
+with array operations, so multi-year histories cost a few milliseconds of
+arithmetic instead of a Python loop per record.
+"""
+from datetime import date, timedelta
+import numpy as np
+from sqlalchemy import case, func, select
+from app import db
+from models import Medication, Consumption
+
+STATUS_CODES = {'taken': 0, 'missed': 1, 'skipped': 2}
+TAKEN = STATUS_CODES['taken']
+
+SECONDS_PER_DAY = 86400
+MINUTES_PER_DAY = 1440
+ROLLING_WINDOWS = (7, 30)
+# Points returned for the rolling adherence chart
+SERIES_DAYS = 90
+# Weeks used to fit per-medication trends
+TREND_WEEKS = 12
+YIELD_PER = 5000
+
+
+def _parse_minutes(scheduled_time):
+    """Return minutes after midnight for an HH:MM string, or NaN if unset or malformed"""
+    try:
+        hours, minutes = scheduled_time.strip().split(':')
+        return int(hours) * 60 + int(minutes)
+    except (AttributeError, ValueError):
+        return np.nan
+
+
+class ConsumptionHistory:
+    """Consumption records of one user held as parallel arrays"""
+
+    def __init__(self, local_epoch, medication_index, quantity, status, medications):
+        self.local_epoch = local_epoch
+        self.medication_index = medication_index
+        self.quantity = quantity
+        self.status = status
+        self.medication_names = [name for _, name, _ in medications]
+        self.scheduled_minutes = np.array(
+            [_parse_minutes(scheduled_time) for _, _, scheduled_time in medications],
+            dtype=np.float64
+        )
+
+    def __len__(self):
+        return len(self.local_epoch)
+
+    @property
+    def day(self):
+        """Local day number (days since the epoch) of every record"""
+        return self.local_epoch // SECONDS_PER_DAY
+
+    @property
+    def minute_of_day(self):
+        return (self.local_epoch % SECONDS_PER_DAY) // 60
+
+
+def load_history(user, end_utc, medication_id=None):
+    """Load a user's consumption up to end_utc into a ConsumptionHistory.
+
+    Timestamps are shifted to the user's wall-clock time in SQL, so day and
+    time-of-day arithmetic below needs no per-record time zone handling.
+    """
+    med_query = select(Medication.id, Medication.name, Medication.scheduled_time).where(
+        Medication.user_id == user.id
+    ).order_by(Medication.id)
+    if medication_id:
+        med_query = med_query.where(Medication.id == medication_id)
+    medications = db.session.execute(med_query).all()
+    medication_ids = np.array([med_id for med_id, _, _ in medications], dtype=np.int64)
+
+    local_time = func.timezone(user.timezone, func.timezone('UTC', Consumption.taken_at))
+    status_code = case(
+        *[(Consumption.status == status, code) for status, code in STATUS_CODES.items()],
+        else_=TAKEN
+    )
+    query = (
+        select(
+            func.extract('epoch', local_time),
+            Consumption.medication_id,
+            Consumption.quantity,
+            status_code
+        )
+        .join(Medication)
+        .where(Medication.user_id == user.id, Consumption.taken_at < end_utc)
+        .order_by(Consumption.taken_at)
+        .execution_options(yield_per=YIELD_PER)
+    )
+    if medication_id:
+        query = query.where(Medication.id == medication_id)
+
+    chunks = [
+        np.array([tuple(row) for row in partition], dtype=np.float64).reshape(-1, 4)
+        for partition in db.session.execute(query).partitions()
+    ]
+    rows = np.concatenate(chunks) if chunks else np.empty((0, 4), dtype=np.float64)
+
+    return ConsumptionHistory(
+        local_epoch=rows[:, 0].astype(np.int64),
+        medication_index=np.searchsorted(medication_ids, rows[:, 1].astype(np.int64)).astype(np.int32),
+        quantity=rows[:, 2].astype(np.int32),
+        status=rows[:, 3].astype(np.int8),
+        medications=medications
+    )
+
+
+def daily_counts(history, first_day, last_day):
+    """Return (taken, logged) dose counts for every day from first_day to last_day"""
+    span = last_day - first_day + 1
+    days = history.day - first_day
+    in_range = (days >= 0) & (days < span)
+    days = days[in_range]
+    taken = np.bincount(days, weights=(history.status[in_range] == TAKEN), minlength=span)
+    logged = np.bincount(days, minlength=span).astype(np.float64)
+    return taken, logged
+
+
+def rolling_adherence(taken, logged, window):
+    """Percentage of logged doses taken over a trailing window ending on each day"""
+    taken_sum = np.convolve(taken, np.ones(window), mode='full')[:len(taken)]
+    logged_sum = np.convolve(logged, np.ones(window), mode='full')[:len(logged)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(logged_sum > 0, taken_sum / logged_sum * 100, np.nan)
+
+
+def streaks(taken, logged):
+    """Return (longest, current) runs of days on which every logged dose was taken"""
+    # Nothing logged yet on the last day (usually today) does not break the
+    # current streak; it then runs up to the day before
+    if len(logged) and logged[-1] == 0:
+        taken, logged = taken[:-1], logged[:-1]
+    adherent = (logged > 0) & (taken == logged)
+    if not adherent.any():
+        return 0, 0
+    padded = np.concatenate(([False], adherent, [False])).astype(np.int8)
+    edges = np.diff(padded)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    lengths = ends - starts
+    current = int(lengths[-1]) if ends[-1] == len(adherent) else 0
+    return int(lengths.max()), current
+
+
+def schedule_deviation(history):
+    """Mean absolute minutes between taken doses and each medication's scheduled time"""
+    count = len(history.medication_names)
+    scheduled = history.scheduled_minutes[history.medication_index]
+    mask = (history.status == TAKEN) & ~np.isnan(scheduled)
+    deviation = history.minute_of_day[mask] - scheduled[mask]
+    # Wrap to [-720, 720) so 23:50 against 00:10 counts as 20 minutes early
+    deviation = (deviation + MINUTES_PER_DAY / 2) % MINUTES_PER_DAY - MINUTES_PER_DAY / 2
+    index = history.medication_index[mask]
+    totals = np.bincount(index, weights=np.abs(deviation), minlength=count)
+    counts = np.bincount(index, minlength=count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+def weekly_trends(history, last_day, weeks=TREND_WEEKS):
+    """Least-squares slope of weekly quantity per medication, in doses per week per week"""
+    count = len(history.medication_names)
+    week = (last_day - history.day) // 7
+    mask = (week >= 0) & (week < weeks)
+    # Column 0 is the oldest week
+    column = weeks - 1 - week[mask]
+    matrix = np.bincount(
+        history.medication_index[mask] * weeks + column,
+        weights=history.quantity[mask],
+        minlength=count * weeks
+    ).reshape(count, weeks)
+    x = np.arange(weeks, dtype=np.float64)
+    x_centered = x - x.mean()
+    y_centered = matrix - matrix.mean(axis=1, keepdims=True)
+    return (y_centered @ x_centered) / (x_centered @ x_centered)
+
+
+def _rounded(value, digits=1):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def build_trends(user, filters):
+    """Compute the trends section of the reports page"""
+    history = load_history(user, filters.end_utc, filters.medication_id)
+    last_day = (filters.end_day - date(1970, 1, 1)).days
+    first_day = min(history.day.min(), last_day) if len(history) else last_day
+    taken, logged = daily_counts(history, first_day, last_day)
+
+    series_days = min(SERIES_DAYS, len(taken))
+    rolling = {
+        str(window): rolling_adherence(taken, logged, window)[-series_days:]
+        for window in ROLLING_WINDOWS
+    }
+    longest_streak, current_streak = streaks(taken, logged)
+
+    deviations = schedule_deviation(history)
+    slopes = weekly_trends(history, last_day)
+    doses = np.bincount(history.medication_index, weights=history.quantity,
+                        minlength=len(history.medication_names))
+
+    return {
+        'rolling_adherence': {window: _rounded(values[-1]) for window, values in rolling.items()},
+        'rolling_series': {
+            'dates': [
+                (filters.end_day - timedelta(days=offset)).isoformat()
+                for offset in range(series_days - 1, -1, -1)
+            ],
+            **{window: [_rounded(value) for value in values] for window, values in rolling.items()}
+        },
+        'longest_streak': longest_streak,
+        'current_streak': current_streak,
+        'medications': [
+            {
+                'name': name,
+                'doses': int(doses[index]),
+                'mean_deviation_minutes': _rounded(deviations[index]),
+                'trend_per_week': _rounded(slopes[index], 2)
+            }
+            for index, name in enumerate(history.medication_names)
+        ]
+    }
@@ -1,17 +1,20 @@
 import os
 import time
 import logging
+import click
 from datetime import datetime
-from flask import Flask, render_template
+from flask import Flask, render_template, request, g, has_request_context, flash, redirect, url_for
+from jinja2 import FileSystemBytecodeCache
 from sqlalchemy import event
 from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from flask_migrate import Migrate
 from sqlalchemy.orm import DeclarativeBase
 from flask_wtf.csrf import CSRFProtect
 
 # Configure logging at module level
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 class Base(DeclarativeBase):
@@ -19,9 +22,33 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 login_manager = LoginManager()
+migrate = Migrate()
 
-def create_app():
+def precompile_templates(app):
+    """Load every template so none is compiled while serving a request"""
+    started = time.perf_counter()
+    count = 0
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+            count += 1
+        except Exception as e:
+            logger.error(f"Failed to compile template {name}: {str(e)}")
+    logger.info(f"Precompiled {count} templates in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def create_app(test_config=None):
     app = Flask(__name__)
+    
+    # Production profile: templates are compiled once at startup from a
+    # bytecode cache that survives restarts, and never re-checked on disk
+    app.config["PRODUCTION"] = os.environ.get("FLASK_ENV") == "production"
+    app.config["TEMPLATES_AUTO_RELOAD"] = not app.config["PRODUCTION"]
+    if app.config["PRODUCTION"]:
+        # Must be set before anything touches app.jinja_env
+        cache_dir = os.environ.get("JINJA_CACHE_DIR") or os.path.join(app.instance_path, "jinja_cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(cache_dir)}
+    
     csrf = CSRFProtect()
     csrf.init_app(app)
     
@@ -94,7 +121,20 @@ def create_app():
     
     # Configure static files
     app.config["STATIC_FOLDER"] = "static"
-    app.config["TEMPLATES_AUTO_RELOAD"] = True
+    # Hashed asset names are computed at startup, so leave them off while
+    # editing assets in development
+    app.config["ASSETS_FINGERPRINT"] = os.environ.get(
+        "ASSETS_FINGERPRINT", str(app.config["PRODUCTION"])
+    ).lower() in ("1", "true", "yes")
+    
+    # Report cache sizing (defaults suit a Raspberry Pi)
+    app.config["REPORT_CACHE_MAX_ENTRIES"] = int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", 256))
+    app.config["REPORT_CACHE_MAX_BYTES"] = int(os.environ.get("REPORT_CACHE_MAX_BYTES", 4 * 1024 * 1024))
+    app.config["REPORT_CACHE_TTL"] = int(os.environ.get("REPORT_CACHE_TTL", 300))
+    
+    # Tests point the app at their own database and settings
+    if test_config is not None:
+        app.config.update(test_config)
     
     # Initialize database with enhanced error handling
     try:
@@ -115,17 +155,79 @@ def create_app():
         logger.error(f"Unexpected database error: {str(e)}")
         raise
     
+    # Count queries per request so N+1 regressions show up in the logs
+    app.config["QUERY_COUNT_WARNING"] = int(os.environ.get("QUERY_COUNT_WARNING", 20))
+    with app.app_context():
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def count_queries(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                g.query_count = g.get('query_count', 0) + 1
+    
+    @app.after_request
+    def report_query_count(response):
+        query_count = g.get('query_count', 0)
+        if query_count > app.config["QUERY_COUNT_WARNING"]:
+            logger.warning(f"{request.endpoint} ran {query_count} queries")
+        if app.debug:
+            response.headers['X-Query-Count'] = str(query_count)
+        return response
+    
+    # Schema changes are applied with `flask db upgrade`
+    migrate.init_app(app, db)
+    
+    # Initialize report cache
+    from cache import report_cache
+    report_cache.init_app(app)
+    
+    # Compress HTML, JSON and export responses; a Pi can lower the level to
+    # spend less CPU per response
+    app.config["COMPRESS_LEVEL"] = int(os.environ.get("COMPRESS_LEVEL", 6))
+    app.config["COMPRESS_BROTLI_QUALITY"] = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 4))
+    app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+    from compression import compressor
+    compressor.init_app(app)
+    
     # Initialize login manager
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message_category = 'info'
     
+    # Stored timestamps are naive UTC; templates show them in the user's zone
+    from timeutils import to_local
+    app.add_template_filter(to_local)
+    
     # Register blueprints
     from routes import main_bp
     from auth import auth_bp
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp, url_prefix='/auth')
     
+    # Prescription uploads live outside the static folder
+    app.config["PRESCRIPTION_STORAGE"] = os.environ.get("PRESCRIPTION_STORAGE")
+    # Bodies larger than this are refused from Content-Length before any of
+    # them is read; prescription uploads also get per-type caps as they stream
+    app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_CONTENT_LENGTH", 21 * 1024 * 1024))
+    from uploads import UploadRequest
+    app.request_class = UploadRequest
+    # Let a fronting web server send prescription files instead of Python:
+    # X-Sendfile (Apache, lighttpd) or an nginx internal location prefix
+    app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+    app.config["PRESCRIPTION_ACCEL_REDIRECT"] = os.environ.get("PRESCRIPTION_ACCEL_REDIRECT")
+    from storage import blob_store
+    blob_store.init_app(app)
+    
+    # Thumbnails are generated in the background; keep one worker on a Pi
+    app.config["THUMBNAIL_WORKERS"] = int(os.environ.get("THUMBNAIL_WORKERS", 1))
+    from thumbnails import pipeline
+    pipeline.init_app(app)
+    
+    # Serve fingerprinted, precompressed static assets
+    import assets
+    assets.init_app(app)
+    
+    if app.config["PRODUCTION"]:
+        precompile_templates(app)
+    
     @login_manager.user_loader
     def load_user(id):
         from models import User
@@ -197,18 +299,91 @@ def create_app():
                 }
             }, 500
 
+    # Cache metrics endpoint
+    @app.route('/metrics')
+    def metrics():
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "report_cache": report_cache.stats(),
+            "compression": compressor.stats()
+        }, 200
+
     # Error handlers
     @app.errorhandler(404)
     def not_found_error(error):
         return render_template('404.html'), 404
     
+    # Uploads rejected while streaming go back to the form with a message
+    @app.errorhandler(413)
+    def request_too_large(error):
+        if request.is_json:
+            return {"error": "Upload is too large"}, 413
+        flash('The file is too large. Images may be up to 15MB and PDFs up to 20MB.', 'danger')
+        return redirect(request.referrer or url_for('main.dashboard'))
+    
+    @app.errorhandler(415)
+    def unsupported_upload(error):
+        if request.is_json:
+            return {"error": "Unsupported file type"}, 415
+        flash('Invalid file type. Please upload a PDF or image file.', 'danger')
+        return redirect(request.referrer or url_for('main.dashboard'))
+    
     @app.errorhandler(500)
     def internal_error(error):
         db.session.rollback()
         return render_template('500.html'), 500
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
+    @app.cli.command('backfill-rollups')
+    def backfill_rollups():
+        """Rebuild daily consumption rollups from existing consumption history."""
+        from models import DailyConsumptionRollup
+        try:
+            rows = DailyConsumptionRollup.backfill()
+            db.session.commit()
+            logger.info(f"Backfilled {rows} daily consumption rollup rows")
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Rollup backfill failed: {str(e)}")
+            raise
     
+    @app.cli.command('sweep-expiring')
+    @click.option('--days', default=30, show_default=True, help='Notify about prescriptions expiring within this many days.')
+    def sweep_expiring_prescriptions(days):
+        """Write notifications for prescriptions that expire soon."""
+        from expiry import sweep_expiring
+        try:
+            sweep_expiring(days)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Expiry sweep failed: {str(e)}")
+            raise
+    
+    @app.cli.command('import-prescription-files')
+    def import_prescription_files():
+        """Move prescriptions uploaded before the blob store into it."""
+        import mimetypes
+        from models import Prescription, PrescriptionBlob
+        imported = 0
+        for prescription in Prescription.query.filter(Prescription.blob_sha256.is_(None)).all():
+            if not os.path.isfile(prescription.file_path):
+                logger.warning(f"Prescription {prescription.id} file is missing: {prescription.file_path}")
+                continue
+            try:
+                with open(prescription.file_path, 'rb') as f:
+                    sha256, size = blob_store.save(f)
+                PrescriptionBlob.acquire(sha256, size, mimetypes.guess_type(prescription.file_name)[0])
+                legacy_path = prescription.file_path
+                prescription.blob_sha256 = sha256
+                prescription.file_path = blob_store.relative_path(sha256)
+                db.session.commit()
+                imported += 1
+            except (OSError, SQLAlchemyError) as e:
+                db.session.rollback()
+                logger.error(f"Failed to import prescription {prescription.id}: {str(e)}")
+                continue
+            # Shared filenames may still be needed by other legacy rows
+            if not Prescription.query.filter_by(file_path=legacy_path).first():
+                os.remove(legacy_path)
+        logger.info(f"Imported {imported} prescription files into the blob store")
+
     return app
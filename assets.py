@@ -0,0 +1,107 @@
+"""Fingerprinted, precompressed static assets.
+
+At startup every stylesheet and script under static/ is copied to
+static/dist with a content hash in its name, next to gzip and (when the
+brotli package is installed) brotli variants. url_for('static', ...) then
+resolves to the hashed names, and those are served with a year-long
+immutable Cache-Control and the best encoding the client accepts, so repeat
+visits never re-download an unchanged asset.
+"""
+import gzip
+import hashlib
+import logging
+import os
+from flask import request, send_from_directory
+from compression import negotiate_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+EXTENSIONS = ('.css', '.js')
+MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+HASH_LENGTH = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _write(path, data):
+    # Write to a temporary name first so a request never sees a partial file
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def build_assets(static_folder):
+    """Write hashed and compressed copies of the static assets; returns {filename: hashed filename}"""
+    manifest = {}
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [name for name in dirs if name not in (DIST_DIR, 'uploads')]
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            if ext not in EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            with open(source, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            hashed = f'{os.path.dirname(filename)}/{stem}.{digest}{ext}'.lstrip('/')
+            target = os.path.join(dist_folder, hashed)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # mtime=0 keeps the gzip output identical across builds
+                _write(f'{target}.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(f'{target}.br', brotli.compress(data, quality=11))
+                _write(target, data)
+            manifest[filename] = f'{DIST_DIR}/{hashed}'
+    return manifest
+
+
+def _serve_static(app, filename):
+    if not filename.startswith(f'{DIST_DIR}/'):
+        return app.send_static_file(filename)
+
+    ext = os.path.splitext(filename)[1]
+    available = [
+        name for name, suffix in ENCODINGS
+        if os.path.isfile(os.path.join(app.static_folder, filename + suffix))
+    ]
+    encoding = negotiate_encoding(request.accept_encodings, available)
+    served = filename + dict(ENCODINGS)[encoding] if encoding else filename
+
+    response = send_from_directory(app.static_folder, served, mimetype=MIMETYPES.get(ext))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+def init_app(app):
+    """Fingerprint the static assets and route static URLs to the hashed copies"""
+    if not app.config.get('ASSETS_FINGERPRINT'):
+        return
+    try:
+        manifest = build_assets(app.static_folder)
+    except OSError as e:
+        logger.error(f"Failed to build static assets, serving originals: {str(e)}")
+        return
+    logger.info(f"Fingerprinted {len(manifest)} static assets")
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    app.view_functions['static'] = lambda filename: _serve_static(app, filename)
@@ -21,7 +21,8 @@ def register():
                 user = User(
                     username=form.username.data,
                     email=form.email.data,
-                    password_hash=generate_password_hash(form.password.data)
+                    password_hash=generate_password_hash(form.password.data),
+                    timezone=form.timezone.data
                 )
                 db.session.add(user)
                 db.session.commit()
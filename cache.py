@@ -0,0 +1,170 @@
+"""In-process cache for computed report payloads and page revalidation.
+
+Every user has a data version that write routes bump after committing. The
+version is part of each cache key, so a write makes that user's cached reports
+unreachable immediately; the stale entries are dropped straight away to keep
+the memory cap available for live data. The same version drives the weak
+ETags of the per-user HTML pages.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import make_response, request, session
+
+# Versions live in memory, so ETags also carry a per-process token to stay
+# unique across restarts
+BOOT_ID = os.urandom(8).hex()
+
+# Page ETags also change every half hour: a revalidated page never carries a
+# CSRF token older than this, well inside Flask-WTF's one hour limit, and the
+# boundaries fall on local midnight for whole and half hour UTC offsets, so
+# "today" figures roll over without a write
+PAGE_ETAG_WINDOW = 30 * 60
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def get_user_version(user_id):
+    with _versions_lock:
+        return _versions.get(user_id, 0)
+
+
+def bump_user_version(user_id):
+    """Mark a user's data as changed after a committed write"""
+    with _versions_lock:
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+        version = _versions[user_id]
+    report_cache.discard_user(user_id)
+    return version
+
+
+def user_etag(user_id, *parts):
+    """Build an ETag value that changes whenever the user's data version does"""
+    key = ':'.join(str(part) for part in (BOOT_ID, user_id, get_user_version(user_id)) + parts)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def conditional_page(page):
+    """Answer GET revalidations of a per-user HTML page with 304 Not Modified.
+
+    Applied outside login_required: the user id is read straight from the
+    session, so a matching If-None-Match is answered before the user is loaded
+    or any query runs. Requests with pending flash messages are always
+    rendered, and those responses carry no ETag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Flask-Login stores the id as a string; versions are keyed by the int
+            try:
+                user_id = int(session['_user_id'])
+            except (KeyError, TypeError, ValueError):
+                user_id = None
+            if request.method != 'GET' or user_id is None or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            etag = user_etag(
+                user_id, page, request.full_path, session.get('csrf_token'),
+                int(time.time() // PAGE_ETAG_WINDOW)
+            )
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+class ReportCache:
+    """LRU cache with a TTL and an approximate memory cap"""
+
+    def __init__(self, max_entries=256, max_bytes=4 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('REPORT_CACHE_MAX_ENTRIES', self.max_entries)
+        self.max_bytes = app.config.get('REPORT_CACHE_MAX_BYTES', self.max_bytes)
+        self.ttl = app.config.get('REPORT_CACHE_TTL', self.ttl)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, size, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, key, payload):
+        size = len(json.dumps(payload, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, user_id, params, compute):
+        """Return the cached payload for a user's current data version, computing it on a miss"""
+        key = (user_id, get_user_version(user_id)) + tuple(params)
+        payload = self.get(key)
+        if payload is None:
+            payload = compute()
+            self.set(key, payload)
+        return payload
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0
+            }
+
+
+report_cache = ReportCache()
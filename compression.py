@@ -0,0 +1,190 @@
+"""On-the-fly gzip and brotli compression of HTML, JSON and export responses.
+
+Responses are compressed after the view returns, using the best encoding in
+the request's Accept-Encoding. Buffered bodies under the size threshold are
+left alone; streamed bodies are compressed chunk by chunk and flushed after
+each one, so exports still reach the client as they are produced.
+
+HTML that carries a CSRF token is sent uncompressed. Compressed size leaks
+how well attacker-chosen text in a page matches the secret next to it
+(BREACH), and these pages can echo request data back in form values and
+flash messages. Pages without forms, JSON and exports are still compressed.
+"""
+import logging
+import threading
+import time
+import zlib
+from flask import current_app, g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = {
+    'text/html',
+    'text/plain',
+    'text/csv',
+    'text/css',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson'
+}
+
+
+def negotiate_encoding(accept_encodings, supported):
+    """Return the supported encoding the client rates highest, or None.
+
+    supported is in order of preference, which breaks ties; an encoding
+    with q=0 is refused, and identity is always acceptable as the fallback.
+    """
+    best, best_quality = None, 0
+    for name in supported:
+        quality = accept_encodings.quality(name)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class _Gzip:
+    def __init__(self, level):
+        # wbits=31 selects the gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ResponseCompressor:
+    """after_request hook compressing responses, with running totals for /metrics"""
+
+    def __init__(self, level=6, brotli_quality=4, min_size=500):
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def init_app(self, app):
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', self.brotli_quality)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', self.min_size)
+        app.after_request(self.compress_response)
+
+    def _carries_csrf_token(self, response):
+        # Flask-WTF keeps the token generated for this request in g
+        field_name = current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+        return response.mimetype == 'text/html' and field_name in g
+
+    def _choose_encoding(self):
+        supported = ('br', 'gzip') if brotli is not None else ('gzip',)
+        return negotiate_encoding(request.accept_encodings, supported)
+
+    def _compressor(self, encoding):
+        return _Brotli(self.brotli_quality) if encoding == 'br' else _Gzip(self.level)
+
+    def _record(self, encoding, size_in, size_out, seconds):
+        with self._lock:
+            totals = self._totals.setdefault(
+                encoding, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+            )
+            totals['responses'] += 1
+            totals['bytes_in'] += size_in
+            totals['bytes_out'] += size_out
+            totals['seconds'] += seconds
+
+    def compress_response(self, response):
+        # Files from send_file are passed straight to the server, and static
+        # assets are already served precompressed
+        if (response.direct_passthrough
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or response.cache_control.no_transform
+                or self._carries_csrf_token(response)):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self._choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            started = time.perf_counter()
+            compressor = self._compressor(encoding)
+            compressed = compressor.compress(data) + compressor.finish()
+            self._record(encoding, len(data), len(compressed), time.perf_counter() - started)
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        # The compressed body is a different byte sequence, so a strong
+        # validator from the view no longer applies to it
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compress_stream(self, chunks, encoding):
+        compressor = self._compressor(encoding)
+        size_in = size_out = 0
+        seconds = 0.0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                started = time.perf_counter()
+                compressed = compressor.compress(chunk)
+                seconds += time.perf_counter() - started
+                size_in += len(chunk)
+                size_out += len(compressed)
+                yield compressed
+            compressed = compressor.finish()
+            size_out += len(compressed)
+            yield compressed
+            self._record(encoding, size_in, size_out, seconds)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'level': self.level,
+                'brotli_quality': self.brotli_quality,
+                'brotli_available': brotli is not None,
+                'min_size': self.min_size,
+                'encodings': {
+                    encoding: {
+                        **totals,
+                        'ratio': (totals['bytes_out'] / totals['bytes_in']) if totals['bytes_in'] else 0,
+                        'mean_ms': totals['seconds'] * 1000 / totals['responses']
+                    }
+                    for encoding, totals in self._totals.items()
+                }
+            }
+
+
+compressor = ResponseCompressor()
@@ -701,12 +701,18 @@ def setup_database():
                 logger.error(f"Database connection failed: {str(e)}")
                 return False
             
-            # Create tables
+            # Apply schema migrations
             try:
-                db.create_all()
-                logger.info("Database tables creation initiated")
+                from flask_migrate import upgrade, stamp
+                existing_tables = set(inspect(db.engine).get_table_names())
+                if 'medication' in existing_tables and 'alembic_version' not in existing_tables:
+                    # Database was created by db.create_all() before migrations existed
+                    stamp(revision='0001_baseline')
+                    logger.info("Stamped existing database at baseline revision")
+                upgrade()
+                logger.info("Database migrations applied")
             except Exception as e:
-                logger.error(f"Failed to create tables: {str(e)}")
+                logger.error(f"Failed to apply migrations: {str(e)}")
                 return False
             
             # Verify tables were created
@@ -0,0 +1,172 @@
+"""Dose logging as single database round trips."""
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import Integer, column, insert, literal, select, update, values
+from app import db
+from models import Medication, Consumption, InventoryLog, DailyConsumptionRollup
+from timeutils import local_day
+
+# Most items accepted in one bulk request
+MAX_ITEMS = 500
+
+
+def log_dose(user, medication_id, quantity, taken_at=None):
+    """Record a taken dose and decrement stock atomically.
+
+    The conditional stock decrement, the Consumption and InventoryLog inserts
+    and the rollup upsert are chained as data-modifying CTEs in one
+    statement. If the medication is not the user's or has too little stock,
+    the UPDATE matches no row, nothing is inserted and None is returned;
+    otherwise the remaining stock is returned. The caller commits.
+    """
+    taken_at = taken_at or datetime.utcnow()
+
+    decrement = (
+        update(Medication)
+        .where(
+            Medication.id == medication_id,
+            Medication.user_id == user.id,
+            Medication.current_stock >= quantity
+        )
+        # Column onupdate defaults are not filled in for an UPDATE inside a
+        # CTE, and updated_at is NOT NULL, so it is set explicitly
+        .values(current_stock=Medication.current_stock - quantity, updated_at=datetime.utcnow())
+        .returning(Medication.id, Medication.current_stock, Medication.scheduled_time)
+        .cte('stock_decrement')
+    )
+
+    consumption = (
+        insert(Consumption)
+        .from_select(
+            ['medication_id', 'quantity', 'taken_at', 'scheduled_time', 'status'],
+            select(
+                decrement.c.id,
+                literal(quantity),
+                literal(taken_at),
+                decrement.c.scheduled_time,
+                literal('taken')
+            )
+        )
+        .returning(Consumption.id, Consumption.medication_id)
+        .cte('consumption_insert')
+    )
+
+    inventory_log = (
+        insert(InventoryLog)
+        .from_select(
+            ['medication_id', 'quantity_change', 'operation_type', 'timestamp'],
+            select(decrement.c.id, literal(-quantity), literal('remove'), literal(taken_at))
+        )
+        .cte('inventory_log_insert')
+    )
+
+    rollup = DailyConsumptionRollup.increment_from(
+        select(
+            literal(user.id),
+            decrement.c.id,
+            literal(local_day(taken_at, user.zone)),
+            literal('taken'),
+            literal(quantity),
+            literal(1)
+        )
+    ).cte('rollup_upsert')
+
+    row = db.session.execute(
+        select(decrement.c.current_stock, consumption.c.id)
+        .join_from(decrement, consumption, consumption.c.medication_id == decrement.c.id)
+        .add_cte(inventory_log, rollup)
+    ).first()
+    return row.current_stock if row else None
+
+
+def log_doses(user, items, taken_at=None):
+    """Record taken doses for several medications in one transaction.
+
+    items is an iterable of (medication_id, quantity); quantities for the same
+    medication are combined. Stock for every medication is decremented by one
+    UPDATE ... FROM (VALUES ...), and the Consumption, InventoryLog and rollup
+    rows for the medications that had enough stock are written as batched
+    inserts. Returns one result dict per medication; the caller commits.
+    """
+    taken_at = taken_at or datetime.utcnow()
+    day = local_day(taken_at, user.zone)
+
+    requested = OrderedDict()
+    for medication_id, quantity in items:
+        requested[medication_id] = requested.get(medication_id, 0) + quantity
+    if not requested:
+        return []
+
+    doses = values(
+        column('medication_id', Integer),
+        column('quantity', Integer),
+        name='doses'
+    ).data(list(requested.items()))
+
+    updated = db.session.execute(
+        update(Medication)
+        .where(
+            Medication.id == doses.c.medication_id,
+            Medication.user_id == user.id,
+            Medication.current_stock >= doses.c.quantity
+        )
+        .values(current_stock=Medication.current_stock - doses.c.quantity)
+        .returning(Medication.id, Medication.current_stock, Medication.scheduled_time)
+    ).all()
+    logged = {row.id: row for row in updated}
+
+    if logged:
+        db.session.execute(insert(Consumption), [
+            {
+                'medication_id': medication_id,
+                'quantity': requested[medication_id],
+                'taken_at': taken_at,
+                'scheduled_time': row.scheduled_time,
+                'status': 'taken'
+            }
+            for medication_id, row in logged.items()
+        ])
+        db.session.execute(insert(InventoryLog), [
+            {
+                'medication_id': medication_id,
+                'quantity_change': -requested[medication_id],
+                'operation_type': 'remove',
+                'timestamp': taken_at
+            }
+            for medication_id in logged
+        ])
+        DailyConsumptionRollup.increment_many([
+            {
+                'user_id': user.id,
+                'medication_id': medication_id,
+                'day': day,
+                'status': 'taken',
+                'quantity': requested[medication_id],
+                'dose_count': 1
+            }
+            for medication_id in logged
+        ])
+
+    # Tell low stock apart from medications that are missing or not the user's
+    failed = [medication_id for medication_id in requested if medication_id not in logged]
+    owned = set()
+    if failed:
+        owned = set(db.session.execute(
+            select(Medication.id).where(Medication.id.in_(failed), Medication.user_id == user.id)
+        ).scalars())
+
+    results = []
+    for medication_id, quantity in requested.items():
+        if medication_id in logged:
+            status = 'logged'
+        elif medication_id in owned:
+            status = 'insufficient_stock'
+        else:
+            status = 'not_found'
+        results.append({
+            'medication_id': medication_id,
+            'quantity': quantity,
+            'status': status,
+            'remaining_stock': logged[medication_id].current_stock if medication_id in logged else None
+        })
+    return results
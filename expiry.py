@@ -0,0 +1,94 @@
+"""Sweeper turning upcoming prescription expiries into notifications.
+
+Prescriptions expiring inside the window are read across all users in
+keyset-paginated batches over ix_prescription_expiry_date, so each batch is
+one short index range scan however many prescriptions exist. Each batch is
+written with INSERT ... ON CONFLICT DO NOTHING, which makes re-running the
+sweep harmless.
+"""
+import logging
+from datetime import datetime, time, timedelta
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app import db
+from models import Medication, Prescription, Notification
+
+logger = logging.getLogger(__name__)
+
+KIND = 'prescription_expiring'
+BATCH_SIZE = 1000
+# Expired notifications are kept this long before being purged
+RETENTION = timedelta(days=30)
+WIDGET_LIMIT = 5
+
+
+def sweep_expiring(days, batch_size=BATCH_SIZE, now=None):
+    """Create notifications for prescriptions expiring within days; returns the number created"""
+    now = now or datetime.utcnow()
+    # Expiry dates are stored as midnight, so one expiring today still counts
+    today = datetime.combine(now.date(), time.min)
+    horizon = today + timedelta(days=days + 1)
+    created = 0
+    last_expiry, last_id = today, 0
+
+    while True:
+        batch = db.session.execute(
+            select(
+                Prescription.id,
+                Prescription.expiry_date,
+                Medication.user_id,
+                Medication.name
+            )
+            .join(Medication)
+            .where(
+                # The plain range bound keeps this an index range scan; the
+                # row comparison only skips rows already seen at last_expiry
+                Prescription.expiry_date >= last_expiry,
+                Prescription.expiry_date < horizon,
+                tuple_(Prescription.expiry_date, Prescription.id) > tuple_(last_expiry, last_id)
+            )
+            .order_by(Prescription.expiry_date, Prescription.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+
+        result = db.session.execute(
+            pg_insert(Notification)
+            .values([
+                {
+                    'user_id': row.user_id,
+                    'prescription_id': row.id,
+                    'kind': KIND,
+                    'due_at': row.expiry_date,
+                    'message': f'{row.name} prescription expires on {row.expiry_date.strftime("%Y-%m-%d")}',
+                    'created_at': now
+                }
+                for row in batch
+            ])
+            .on_conflict_do_nothing(constraint='uq_notification_prescription_id_kind_due_at')
+        )
+        db.session.commit()
+        created += result.rowcount
+
+        last_expiry, last_id = batch[-1].expiry_date, batch[-1].id
+        if len(batch) < batch_size:
+            break
+
+    purged = db.session.execute(
+        db.delete(Notification).where(Notification.due_at < today - RETENTION)
+    ).rowcount
+    db.session.commit()
+
+    logger.info(f"Expiry sweep created {created} notifications and purged {purged}")
+    return created
+
+
+def get_expiring_soon(user_id, limit=WIDGET_LIMIT, now=None):
+    """Upcoming expiry notifications for the dashboard, soonest first"""
+    today = datetime.combine((now or datetime.utcnow()).date(), time.min)
+    return Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.kind == KIND,
+        Notification.due_at >= today
+    ).order_by(Notification.due_at).limit(limit).all()
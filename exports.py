@@ -0,0 +1,97 @@
+"""Streaming CSV and NDJSON exports of consumption and inventory history.
+
+Rows are read through a server-side cursor in fixed-size partitions and
+written out as they arrive, so memory use does not depend on history size.
+"""
+import csv
+import json
+from datetime import datetime
+from sqlalchemy import select
+from app import db
+from models import Medication, Consumption, InventoryLog
+from timeutils import to_local
+
+YIELD_PER = 500
+
+DATASETS = {
+    'consumption': (
+        Consumption.taken_at,
+        (
+            Consumption.taken_at.label('taken_at'),
+            Medication.name.label('medication'),
+            Medication.dosage.label('dosage'),
+            Consumption.quantity.label('quantity'),
+            Consumption.status.label('status'),
+            Consumption.scheduled_time.label('scheduled_time')
+        ),
+        Consumption
+    ),
+    'inventory': (
+        InventoryLog.timestamp,
+        (
+            InventoryLog.timestamp.label('timestamp'),
+            Medication.name.label('medication'),
+            Medication.dosage.label('dosage'),
+            InventoryLog.quantity_change.label('quantity_change'),
+            InventoryLog.operation_type.label('operation_type')
+        ),
+        InventoryLog
+    )
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+class _Echo:
+    """File-like object that hands back whatever csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def _build_query(dataset, user_id, filters):
+    time_column, columns, model = DATASETS[dataset]
+    query = (
+        select(*columns)
+        .join(Medication, model.medication_id == Medication.id)
+        .where(
+            Medication.user_id == user_id,
+            time_column >= filters.start_utc,
+            time_column < filters.end_utc
+        )
+        .order_by(time_column, model.id)
+        .execution_options(yield_per=YIELD_PER)
+    )
+    if filters.medication_id:
+        query = query.where(Medication.id == filters.medication_id)
+    return query
+
+
+def _serialize(value, zone):
+    # Timestamps are written in the user's zone with their UTC offset, to
+    # match the local-day windows the export was filtered by
+    return to_local(value, zone).isoformat() if isinstance(value, datetime) else value
+
+
+def iter_export(dataset, fmt, user_id, filters, zone):
+    """Yield the export body in chunks of one cursor partition each"""
+    query = _build_query(dataset, user_id, filters)
+    columns = [column.name for column in query.selected_columns]
+
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        # Send the header before the query runs so the first byte goes out immediately
+        yield writer.writerow(columns)
+        for partition in db.session.execute(query).partitions():
+            yield ''.join(
+                writer.writerow([_serialize(value, zone) for value in row]) for row in partition
+            )
+    else:
+        for partition in db.session.execute(query).partitions():
+            yield ''.join(
+                json.dumps({column: _serialize(value, zone) for column, value in zip(columns, row)}) + '\n'
+                for row in partition
+            )
@@ -1,8 +1,9 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, SelectField, IntegerField, DateField, TextAreaField
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, SelectField, IntegerField, DateField, TextAreaField, HiddenField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, NumberRange
 from models import User
+from timeutils import DEFAULT_TIMEZONE, timezone_choices
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -16,6 +17,7 @@ class RegistrationForm(FlaskForm):
     password = PasswordField('Password', validators=[DataRequired()])
     confirm_password = PasswordField(
         'Confirm Password', validators=[DataRequired(), EqualTo('password')])
+    timezone = SelectField('Time Zone', choices=timezone_choices(), default=DEFAULT_TIMEZONE)
     submit = SubmitField('Register')
 
     def validate_username(self, username):
@@ -28,19 +30,27 @@ class RegistrationForm(FlaskForm):
         if user:
             raise ValidationError('Email already registered. Please use another one.')
 
+FREQUENCY_CHOICES = [('daily', 'Daily'), 
+                     ('twice_daily', 'Twice Daily'),
+                     ('weekly', 'Weekly')]
+
 class MedicationForm(FlaskForm):
     name = StringField('Medication Name', validators=[DataRequired()])
     dosage = StringField('Dosage', validators=[DataRequired()])
     frequency = SelectField('Frequency', 
-                          choices=[('daily', 'Daily'), 
-                                 ('twice_daily', 'Twice Daily'),
-                                 ('weekly', 'Weekly')],
+                          choices=FREQUENCY_CHOICES,
                           validators=[DataRequired()])
     current_stock = IntegerField('Current Stock', validators=[DataRequired(), NumberRange(min=0)])
     scheduled_time = StringField('Scheduled Time')
     max_daily_doses = IntegerField('Maximum Daily Doses', validators=[DataRequired(), NumberRange(min=1)])
     submit = SubmitField('Add Medication')
 
+class MedicationImportForm(FlaskForm):
+    import_file = FileField('Medication File',
+                          validators=[FileRequired(),
+                                    FileAllowed(['csv', 'xlsx'], 'CSV or XLSX files only!')])
+    submit = SubmitField('Import Medications')
+
 class InventoryUpdateForm(FlaskForm):
     quantity = IntegerField('Quantity Change (+/-)', validators=[DataRequired()])
     submit = SubmitField('Update Stock')
@@ -50,6 +60,10 @@ class ConsumptionForm(FlaskForm):
     status = SelectField('Status', choices=[('taken', 'Taken'), ('missed', 'Missed'), ('skipped', 'Skipped')])
     submit = SubmitField('Log Dose')
 
+class BulkConsumptionForm(FlaskForm):
+    scheduled_time = HiddenField('Scheduled Time', validators=[DataRequired()])
+    submit = SubmitField('Log All')
+
 class PrescriptionForm(FlaskForm):
     prescription_file = FileField('Prescription Image', 
                                 validators=[FileRequired(),
@@ -0,0 +1,173 @@
+"""Bulk medication import from CSV or XLSX files.
+
+Rows are validated up front, then written in batches: on PostgreSQL each
+batch is streamed into a temporary table with COPY and moved into
+medication and inventory_log by a single INSERT ... SELECT; other databases
+fall back to executemany inserts.
+"""
+import csv
+import io
+import re
+from datetime import datetime, time
+from sqlalchemy import insert, text
+from app import db
+from models import Medication, InventoryLog
+
+BATCH_SIZE = 1000
+COLUMNS = ['name', 'dosage', 'frequency', 'current_stock', 'scheduled_time', 'max_daily_doses']
+REQUIRED_COLUMNS = {'name', 'dosage', 'frequency', 'current_stock'}
+TIME_PATTERN = re.compile(r'^([01]?\d|2[0-3]):[0-5]\d$')
+# Largest value of a PostgreSQL integer column
+MAX_INTEGER = 2 ** 31 - 1
+
+
+def read_rows(file_storage):
+    """Yield (line number, row dict) from an uploaded CSV or XLSX file"""
+    filename = (file_storage.filename or '').lower()
+    if filename.endswith('.xlsx'):
+        # Optional dependency, only needed for spreadsheet imports
+        from openpyxl import load_workbook
+        sheet = load_workbook(file_storage.stream, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(cell).strip().lower() if cell is not None else '' for cell in next(rows, [])]
+        _check_header(header)
+        for line, values in enumerate(rows, start=2):
+            if any(value is not None for value in values):
+                yield line, dict(zip(header, values))
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig'))
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        _check_header(reader.fieldnames)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def _check_header(header):
+    missing = REQUIRED_COLUMNS - set(header)
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _time_text(value):
+    # Spreadsheet time cells arrive as time (or datetime) objects, not text
+    if isinstance(value, (time, datetime)):
+        return value.strftime('%H:%M')
+    return _text(value)
+
+
+def _integer(value, field, minimum):
+    try:
+        number = float(_text(value))
+    except ValueError:
+        raise ValueError(f'{field} must be a whole number')
+    # Rejects 5.7 rather than truncating it, and infinity and NaN
+    if not number.is_integer():
+        raise ValueError(f'{field} must be a whole number')
+    number = int(number)
+    if number < minimum:
+        raise ValueError(f'{field} must be at least {minimum}')
+    # Caught here so one bad row is reported instead of failing the whole COPY
+    if number > MAX_INTEGER:
+        raise ValueError(f'{field} must be at most {MAX_INTEGER}')
+    return number
+
+
+def validate_row(row, frequencies):
+    """Return a clean medication dict for a row; raises ValueError describing the first problem"""
+    name = _text(row.get('name'))
+    dosage = _text(row.get('dosage'))
+    frequency = _text(row.get('frequency')).lower()
+    scheduled_time = _time_text(row.get('scheduled_time'))
+
+    if not name:
+        raise ValueError('Medication Name is required')
+    if len(name) > 100:
+        raise ValueError('Medication Name is longer than 100 characters')
+    if not dosage:
+        raise ValueError('Dosage is required')
+    if len(dosage) > 50:
+        raise ValueError('Dosage is longer than 50 characters')
+    if frequency not in frequencies:
+        raise ValueError(f"Frequency must be one of: {', '.join(frequencies)}")
+    if scheduled_time and not TIME_PATTERN.match(scheduled_time):
+        raise ValueError('Scheduled Time must be HH:MM')
+
+    max_daily_doses = row.get('max_daily_doses')
+    return {
+        'name': name,
+        'dosage': dosage,
+        'frequency': frequency,
+        'current_stock': _integer(row.get('current_stock'), 'Current Stock', 0),
+        'scheduled_time': scheduled_time or None,
+        'max_daily_doses': _integer(max_daily_doses, 'Maximum Daily Doses', 1) if _text(max_daily_doses) else 1
+    }
+
+
+def _copy_batch(user_id, batch, now):
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS medication_import ("
+        "name varchar(100), dosage varchar(50), frequency varchar(50), current_stock integer, "
+        "scheduled_time varchar(50), max_daily_doses integer) ON COMMIT DROP"
+    )
+    cursor.execute("TRUNCATE medication_import")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([row[column] if row[column] is not None else '' for column in COLUMNS])
+    buffer.seek(0)
+    # Empty unquoted fields load as NULL
+    cursor.copy_expert("COPY medication_import FROM STDIN WITH (FORMAT csv)", buffer)
+
+    db.session.execute(text(
+        "WITH inserted AS ("
+        " INSERT INTO medication (name, dosage, frequency, current_stock, scheduled_time,"
+        " max_daily_doses, user_id, created_at, updated_at)"
+        " SELECT name, dosage, frequency, current_stock, scheduled_time, max_daily_doses, :user_id, :now, :now"
+        " FROM medication_import"
+        " RETURNING id, current_stock"
+        ") INSERT INTO inventory_log (medication_id, quantity_change, operation_type, timestamp)"
+        " SELECT id, current_stock, 'add', :now FROM inserted"
+    ), {'user_id': user_id, 'now': now})
+
+
+def _insert_batch(user_id, batch, now):
+    inserted = db.session.execute(
+        insert(Medication).returning(Medication.id, Medication.current_stock, sort_by_parameter_order=True),
+        [{**row, 'user_id': user_id, 'created_at': now} for row in batch]
+    ).all()
+    db.session.execute(insert(InventoryLog), [
+        {
+            'medication_id': row.id,
+            'quantity_change': row.current_stock,
+            'operation_type': 'add',
+            'timestamp': now
+        }
+        for row in inserted
+    ])
+
+
+def import_medications(user_id, file_storage, frequencies):
+    """Validate and insert every row of an upload.
+
+    Returns (imported count, [(line number, error)]). Invalid rows are
+    skipped; valid rows are written in the caller's transaction.
+    """
+    valid, errors = [], []
+    for line, row in read_rows(file_storage):
+        try:
+            valid.append(validate_row(row, frequencies))
+        except ValueError as e:
+            errors.append((line, str(e)))
+
+    write_batch = _copy_batch if db.engine.dialect.name == 'postgresql' else _insert_batch
+    now = datetime.utcnow()
+    for start in range(0, len(valid), BATCH_SIZE):
+        write_batch(user_id, valid[start:start + BATCH_SIZE], now)
+
+    return len(valid), errors
@@ -145,8 +145,37 @@ WantedBy=multi-user.target
 EOF
     fi
 
+    # Daily sweep turning upcoming prescription expiries into dashboard notifications
+    cat > /etc/systemd/system/medtracker-expiry-sweep.service << EOF
+[Unit]
+Description=MedTracker prescription expiry sweep
+After=network.target postgresql.service
+
+[Service]
+Type=oneshot
+User=medtracker
+Group=medtracker
+WorkingDirectory=$(pwd)
+Environment=FLASK_APP=run.py
+Environment=FLASK_ENV=production
+ExecStart=/usr/bin/python3 -m flask sweep-expiring --days 30
+EOF
+
+    cat > /etc/systemd/system/medtracker-expiry-sweep.timer << EOF
+[Unit]
+Description=Run the MedTracker prescription expiry sweep daily
+
+[Timer]
+OnCalendar=*-*-* 01:00:00
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+EOF
+
     systemctl daemon-reload
     systemctl enable medtracker.service
+    systemctl enable medtracker-expiry-sweep.timer
     if detect_raspberry_pi; then
         systemctl enable medtracker-temp-monitor.service
     fi
@@ -168,8 +197,11 @@ DB_NAME="medtracker"
 # Backup database
 pg_dump $DB_NAME > "$BACKUP_DIR/db_backup_$DATE.sql"
 
-# Backup uploads
-tar -czf "$BACKUP_DIR/uploads_backup_$DATE.tar.gz" static/uploads/
+# Backup uploads: the prescription blob store, plus any legacy uploads not yet
+# imported into it (thumbnails are regenerated on demand)
+tar -czf "$BACKUP_DIR/uploads_backup_$DATE.tar.gz" --ignore-failed-read \
+    --exclude=instance/prescriptions/derived --exclude=instance/prescriptions/tmp \
+    instance/prescriptions/ static/uploads/
 
 # Rotate backups (keep last 5)
 cd $BACKUP_DIR
@@ -315,10 +347,15 @@ fi
 # Initialize database
 log "Initializing database..."
 if ! python3 - <<EOF
+from flask_migrate import upgrade, stamp
+from sqlalchemy import inspect
 from app import create_app, db
 app = create_app()
 with app.app_context():
-    db.create_all()
+    tables = set(inspect(db.engine).get_table_names())
+    if 'medication' in tables and 'alembic_version' not in tables:
+        stamp(revision='0001_baseline')
+    upgrade()
 EOF
 then
     log "Error: Failed to initialize database"
@@ -0,0 +1,43 @@
+"""Daily consumption rollups and user time zones
+
+Revision ID: 0002_rollups_and_timezone
+Revises: 0001_baseline
+Create Date: 2026-10-17 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_rollups_and_timezone'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    # Databases stamped at the baseline may already have the rollup table
+    # from db.create_all()
+    if not inspector.has_table('daily_consumption_rollup'):
+        op.create_table('daily_consumption_rollup',
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('medication_id', sa.Integer(), nullable=False),
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('dose_count', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['medication_id'], ['medication.id'], ),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('user_id', 'medication_id', 'day', 'status')
+        )
+
+    if 'timezone' not in [column['name'] for column in inspector.get_columns('user')]:
+        op.add_column('user', sa.Column('timezone', sa.String(length=64), nullable=False, server_default='UTC'))
+
+
+def downgrade():
+    op.drop_column('user', 'timezone')
+    op.drop_table('daily_consumption_rollup')
@@ -0,0 +1,62 @@
+"""Change tracking for offline dose sync
+
+Revision ID: 0004_sync_tracking
+Revises: 0003_hot_path_indexes
+Create Date: 2026-10-17 09:15:00.000000
+
+Every insert or update of a medication, consumption or inventory_log row
+stamps it with the id of the writing transaction. Sync pulls select rows by
+that id rather than by primary key or timestamp, which are assigned before
+commit: a row committed after a later-numbered one would otherwise fall
+behind a client's cursor and never be sent.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_sync_tracking'
+down_revision = '0003_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+TRACKED_TABLES = ('medication', 'consumption', 'inventory_log')
+
+
+def upgrade():
+    op.add_column('medication', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                          server_default=sa.text("(now() at time zone 'utc')")))
+    op.add_column('consumption', sa.Column('idempotency_key', sa.String(length=64), nullable=True))
+    op.create_unique_constraint('uq_consumption_medication_id_idempotency_key', 'consumption',
+                                ['medication_id', 'idempotency_key'])
+
+    # Existing rows get 0, which every cursor has already passed
+    op.execute("""
+        CREATE FUNCTION set_change_xid() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_xid := txid_current();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in TRACKED_TABLES:
+        op.add_column(table, sa.Column('change_xid', sa.BigInteger(), nullable=False, server_default='0'))
+        op.execute(
+            f'CREATE TRIGGER {table}_change_xid BEFORE INSERT OR UPDATE ON {table} '
+            f'FOR EACH ROW EXECUTE FUNCTION set_change_xid()'
+        )
+    op.create_index('ix_consumption_change_xid_id', 'consumption', ['change_xid', 'id'], unique=False)
+    op.create_index('ix_inventory_log_change_xid_id', 'inventory_log', ['change_xid', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_inventory_log_change_xid_id', table_name='inventory_log')
+    op.drop_index('ix_consumption_change_xid_id', table_name='consumption')
+    for table in TRACKED_TABLES:
+        op.execute(f'DROP TRIGGER {table}_change_xid ON {table}')
+        op.drop_column(table, 'change_xid')
+    op.execute('DROP FUNCTION set_change_xid()')
+    op.drop_constraint('uq_consumption_medication_id_idempotency_key', 'consumption', type_='unique')
+    op.drop_column('consumption', 'idempotency_key')
+    op.drop_column('medication', 'updated_at')
@@ -0,0 +1,42 @@
+"""Content-addressed prescription storage
+
+Revision ID: 0005_prescription_blobs
+Revises: 0004_sync_tracking
+Create Date: 2026-10-17 09:20:00.000000
+
+Existing uploads keep their file_path and get a NULL blob_sha256; move them
+into the blob store with `flask import-prescription-files`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_prescription_blobs'
+down_revision = '0004_sync_tracking'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'prescription_blob',
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('content_type', sa.String(length=100), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('sha256')
+    )
+    op.add_column('prescription', sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+    op.create_foreign_key(
+        'prescription_blob_sha256_fkey', 'prescription', 'prescription_blob',
+        ['blob_sha256'], ['sha256']
+    )
+
+
+def downgrade():
+    op.drop_constraint('prescription_blob_sha256_fkey', 'prescription', type_='foreignkey')
+    op.drop_column('prescription', 'blob_sha256')
+    op.drop_table('prescription_blob')
@@ -0,0 +1,39 @@
+"""Precomputed notifications for expiring prescriptions
+
+Revision ID: 0006_notifications
+Revises: 0005_prescription_blobs
+Create Date: 2026-10-17 09:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_notifications'
+down_revision = '0005_prescription_blobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'notification',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('prescription_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=32), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.Column('message', sa.String(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.ForeignKeyConstraint(['prescription_id'], ['prescription.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('prescription_id', 'kind', 'due_at', name='uq_notification_prescription_id_kind_due_at')
+    )
+    op.create_index('ix_notification_user_id_due_at', 'notification', ['user_id', 'due_at'])
+
+
+def downgrade():
+    op.drop_index('ix_notification_user_id_due_at', table_name='notification')
+    op.drop_table('notification')
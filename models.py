@@ -1,15 +1,31 @@
 from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app import db
+from timeutils import DEFAULT_TIMEZONE, get_zone, local_today, local_day_bounds
+
+def _today_bounds(zone):
+    # Half-open UTC range of the local day, so taken_at comparisons can use an index
+    today = local_today(zone)
+    return local_day_bounds(today, today, zone)
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256))
+    timezone = db.Column(db.String(64), nullable=False, default=DEFAULT_TIMEZONE, server_default=DEFAULT_TIMEZONE)
     medications = db.relationship('Medication', backref='user', lazy=True)
 
+    @property
+    def zone(self):
+        return get_zone(self.timezone)
+
 class Medication(db.Model):
+    __table_args__ = (
+        db.Index('ix_medication_user_id_name', 'user_id', 'name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     dosage = db.Column(db.String(50), nullable=False)
@@ -17,17 +33,42 @@ class Medication(db.Model):
     current_stock = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.text("(now() at time zone 'utc')"))
+    # Id of the transaction that last wrote the row, set by a trigger; drives
+    # the sync delta cursor
+    change_xid = db.Column(db.BigInteger, nullable=False, server_default='0')
     scheduled_time = db.Column(db.String(50))  # Store time in HH:MM format
     max_daily_doses = db.Column(db.Integer, default=1)
     consumptions = db.relationship('Consumption', backref='medication', lazy=True, cascade='all, delete-orphan')
     inventory_logs = db.relationship('InventoryLog', backref='medication', lazy=True, cascade='all, delete-orphan')
+    rollups = db.relationship('DailyConsumptionRollup', backref='medication', lazy=True, cascade='all, delete-orphan')
     
     def get_doses_taken_today(self):
-        today = datetime.utcnow().date()
+        start, end = _today_bounds(self.user.zone)
         return Consumption.query.filter(
             Consumption.medication_id == self.id,
-            db.func.date(Consumption.taken_at) == today
+            Consumption.status == 'taken',
+            Consumption.taken_at >= start,
+            Consumption.taken_at < end
         ).count()
+
+    @staticmethod
+    def get_doses_taken_today_by_medication(user):
+        """Return {medication_id: doses taken today} for all of a user's medications in one query"""
+        start, end = _today_bounds(user.zone)
+        rows = db.session.execute(
+            db.select(Consumption.medication_id, db.func.count(Consumption.id))
+            .join(Medication)
+            .where(
+                Medication.user_id == user.id,
+                Consumption.status == 'taken',
+                Consumption.taken_at >= start,
+                Consumption.taken_at < end
+            )
+            .group_by(Consumption.medication_id)
+        ).all()
+        return dict(rows)
         
     def to_dict(self):
         return {
@@ -40,22 +81,136 @@ class Medication(db.Model):
             'max_daily_doses': self.max_daily_doses
         }
 
+    def to_sync_dict(self):
+        return {
+            **self.to_dict(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
 class Consumption(db.Model):
+    __table_args__ = (
+        db.Index('ix_consumption_medication_id_taken_at', 'medication_id', 'taken_at'),
+        db.Index('ix_consumption_change_xid_id', 'change_xid', 'id'),
+        # Keys come from clients, so they are only unique within one medication
+        db.UniqueConstraint('medication_id', 'idempotency_key', name='uq_consumption_medication_id_idempotency_key'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     medication_id = db.Column(db.Integer, db.ForeignKey('medication.id'), nullable=False)
     taken_at = db.Column(db.DateTime, default=datetime.utcnow)
     quantity = db.Column(db.Integer, nullable=False)
     scheduled_time = db.Column(db.String(50))  # Store scheduled time when dose was taken
     status = db.Column(db.String(20), default='taken')  # taken, missed, skipped
+    idempotency_key = db.Column(db.String(64))  # Client-generated for synced doses
+    change_xid = db.Column(db.BigInteger, nullable=False, server_default='0')  # Set by trigger
+
+class DailyConsumptionRollup(db.Model):
+    # Pre-aggregated consumption per user, medication, local calendar day and status
+    __table_args__ = (
+        db.Index('ix_daily_consumption_rollup_user_id_day', 'user_id', 'day'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    medication_id = db.Column(db.Integer, db.ForeignKey('medication.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    dose_count = db.Column(db.Integer, nullable=False, default=0)
+
+    KEY_COLUMNS = ['user_id', 'medication_id', 'day', 'status']
+
+    @classmethod
+    def _accumulate(cls, stmt):
+        # Adds the inserted amounts onto an existing row for the same key
+        return stmt.on_conflict_do_update(
+            index_elements=[cls.user_id, cls.medication_id, cls.day, cls.status],
+            set_={
+                'quantity': cls.quantity + stmt.excluded.quantity,
+                'dose_count': cls.dose_count + stmt.excluded.dose_count
+            }
+        )
+
+    @classmethod
+    def increment(cls, user_id, medication_id, day, status, quantity, dose_count=1):
+        """Add to the rollup row in the current transaction, creating it if needed"""
+        stmt = pg_insert(cls).values(
+            user_id=user_id,
+            medication_id=medication_id,
+            day=day,
+            status=status,
+            quantity=quantity,
+            dose_count=dose_count
+        )
+        db.session.execute(cls._accumulate(stmt))
+
+    @classmethod
+    def increment_many(cls, rows):
+        """Add a batch of rollup amounts in one statement; keys must be unique within the batch"""
+        if rows:
+            db.session.execute(cls._accumulate(pg_insert(cls).values(rows)))
+
+    @classmethod
+    def increment_from(cls, source):
+        """Return an upsert statement adding the rows of a select with columns
+        (user_id, medication_id, day, status, quantity, dose_count)"""
+        return cls._accumulate(
+            pg_insert(cls).from_select(cls.KEY_COLUMNS + ['quantity', 'dose_count'], source)
+        )
+
+    @classmethod
+    def backfill(cls, user_id=None):
+        """Rebuild rollup rows from the raw consumption history"""
+        # Days are calendar days in each user's own time zone
+        taken_day = db.cast(
+            db.func.timezone(User.timezone, db.func.timezone('UTC', Consumption.taken_at)),
+            db.Date
+        )
+        source = db.select(
+            Medication.user_id,
+            Consumption.medication_id,
+            taken_day,
+            db.func.coalesce(Consumption.status, 'taken'),
+            db.func.sum(Consumption.quantity),
+            db.func.count(Consumption.id)
+        ).select_from(Consumption).join(Medication).join(User, User.id == Medication.user_id).group_by(
+            Medication.user_id,
+            Consumption.medication_id,
+            taken_day,
+            db.func.coalesce(Consumption.status, 'taken')
+        )
+
+        delete = db.delete(cls)
+        if user_id is not None:
+            source = source.where(Medication.user_id == user_id)
+            delete = delete.where(cls.user_id == user_id)
+
+        db.session.execute(delete)
+        result = db.session.execute(
+            db.insert(cls).from_select(
+                ['user_id', 'medication_id', 'day', 'status', 'quantity', 'dose_count'],
+                source
+            )
+        )
+        return result.rowcount
 
 class InventoryLog(db.Model):
+    __table_args__ = (
+        db.Index('ix_inventory_log_medication_id_timestamp', 'medication_id', 'timestamp'),
+        db.Index('ix_inventory_log_change_xid_id', 'change_xid', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     medication_id = db.Column(db.Integer, db.ForeignKey('medication.id'), nullable=False)
     quantity_change = db.Column(db.Integer, nullable=False)
     operation_type = db.Column(db.String(20), nullable=False)  # 'add' or 'remove'
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    change_xid = db.Column(db.BigInteger, nullable=False, server_default='0')  # Set by trigger
 
 class Prescription(db.Model):
+    __table_args__ = (
+        db.Index('ix_prescription_expiry_date', 'expiry_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     medication_id = db.Column(db.Integer, db.ForeignKey('medication.id'), nullable=False)
     file_name = db.Column(db.String(255), nullable=False)
@@ -63,4 +218,62 @@ class Prescription(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     expiry_date = db.Column(db.DateTime, nullable=True)
     notes = db.Column(db.Text, nullable=True)
-    medication = db.relationship('Medication', backref='prescriptions')
+    # Content-addressed file in the blob store; None for uploads stored
+    # before it existed, which only have file_path
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('prescription_blob.sha256'), nullable=True)
+    medication = db.relationship('Medication', backref=db.backref('prescriptions', cascade='all, delete-orphan'))
+    blob = db.relationship('PrescriptionBlob')
+
+    @property
+    def is_image(self):
+        return self.blob is not None and (self.blob.content_type or '').startswith('image/')
+
+class Notification(db.Model):
+    # Precomputed alerts, written by `flask sweep-expiring`, so pages never
+    # scan prescriptions to find them
+    __table_args__ = (
+        db.UniqueConstraint('prescription_id', 'kind', 'due_at', name='uq_notification_prescription_id_kind_due_at'),
+        db.Index('ix_notification_user_id_due_at', 'user_id', 'due_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    prescription_id = db.Column(db.Integer, db.ForeignKey('prescription.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)  # prescription_expiring
+    due_at = db.Column(db.DateTime, nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PrescriptionBlob(db.Model):
+    # One stored file, shared by every prescription with identical contents
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100))
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def acquire(cls, sha256, size, content_type=None):
+        """Add a reference to a stored file, creating its row if needed"""
+        stmt = pg_insert(cls).values(
+            sha256=sha256,
+            size=size,
+            content_type=content_type,
+            ref_count=1,
+            created_at=datetime.utcnow()
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[cls.sha256],
+            set_={'ref_count': cls.ref_count + 1}
+        ))
+
+    @classmethod
+    def release(cls, sha256):
+        """Drop a reference; returns True if it was the last one and the row was deleted"""
+        db.session.execute(
+            db.update(cls).where(cls.sha256 == sha256).values(ref_count=cls.ref_count - 1)
+        )
+        deleted = db.session.execute(
+            db.delete(cls).where(cls.sha256 == sha256, cls.ref_count <= 0).returning(cls.sha256)
+        ).first()
+        return deleted is not None
@@ -0,0 +1,218 @@
+"""Aggregate queries backing the consumption reports.
+
+Reports read from DailyConsumptionRollup, so their cost depends on the number
+of days in the window rather than the number of doses logged.
+"""
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import Date, DateTime, cast, func, literal_column, select, tuple_
+from app import db
+from models import Medication, Consumption, DailyConsumptionRollup
+from pagination import encode_cursor, decode_cursor
+from timeutils import local_today, local_day_bounds
+
+STATUSES = ('taken', 'missed', 'skipped')
+RECORDS_PAGE_SIZE = 50
+
+# Chart granularity by window length in days, keeping the number of points bounded
+BUCKETS = (
+    (92, 'day', '%Y-%m-%d'),
+    (731, 'week', '%G-W%V'),
+    (3653, 'month', '%Y-%m'),
+    (None, 'year', '%Y')
+)
+
+ReportFilters = namedtuple(
+    'ReportFilters',
+    ['date_range', 'start_day', 'end_day', 'start_utc', 'end_utc', 'medication_id']
+)
+
+
+def parse_report_filters(args, zone):
+    """Read report filters from a query string; raises ValueError on malformed input.
+
+    Windows are whole calendar days in the user's time zone. start_utc and
+    end_utc give the matching half-open range of stored UTC timestamps.
+    """
+    date_range = args.get('date_range', '7')
+    medication_id = args.get('medication_id', '')
+    medication_id = int(medication_id) if medication_id else None
+
+    today = local_today(zone)
+    if date_range == 'custom':
+        start_day = date.fromisoformat(args.get('start', ''))
+        end_day = date.fromisoformat(args.get('end') or today.isoformat())
+        if end_day < start_day:
+            start_day, end_day = end_day, start_day
+    else:
+        days = int(date_range)
+        if days < 0:
+            raise ValueError('date_range must not be negative')
+        end_day = today
+        try:
+            start_day = today - timedelta(days=days)
+        except OverflowError:
+            raise ValueError(f'date_range is too large: {date_range}')
+
+    try:
+        start_utc, end_utc = local_day_bounds(start_day, end_day, zone)
+    except OverflowError:
+        # Days next to date.min or date.max have no UTC bound in every zone
+        raise ValueError('Date range is out of bounds')
+    return ReportFilters(date_range, start_day, end_day, start_utc, end_utc, medication_id)
+
+
+def choose_bucket(start_day, end_day):
+    """Return the (bucket, label format) used to chart a window"""
+    span = (end_day - start_day).days + 1
+    for limit, bucket, label_format in BUCKETS:
+        if limit is None or span <= limit:
+            return bucket, label_format
+
+
+def _consumption_criteria(user_id, filters):
+    criteria = [
+        Medication.user_id == user_id,
+        Consumption.taken_at >= filters.start_utc,
+        Consumption.taken_at < filters.end_utc
+    ]
+    if filters.medication_id:
+        criteria.append(Medication.id == filters.medication_id)
+    return criteria
+
+
+def _rollup_criteria(user_id, filters):
+    criteria = [
+        DailyConsumptionRollup.user_id == user_id,
+        DailyConsumptionRollup.day >= filters.start_day,
+        DailyConsumptionRollup.day <= filters.end_day
+    ]
+    if filters.medication_id:
+        criteria.append(DailyConsumptionRollup.medication_id == filters.medication_id)
+    return criteria
+
+
+def get_summary(criteria):
+    """Return total quantity, dose count and taken count in one pass"""
+    row = db.session.execute(
+        select(
+            func.coalesce(func.sum(DailyConsumptionRollup.quantity), 0),
+            func.coalesce(func.sum(DailyConsumptionRollup.dose_count), 0),
+            func.coalesce(
+                func.sum(DailyConsumptionRollup.dose_count).filter(DailyConsumptionRollup.status == 'taken'),
+                0
+            )
+        ).where(*criteria)
+    ).one()
+    return int(row[0]), int(row[1]), int(row[2])
+
+
+def get_status_distribution(criteria):
+    rows = db.session.execute(
+        select(DailyConsumptionRollup.status, func.sum(DailyConsumptionRollup.dose_count))
+        .where(*criteria)
+        .group_by(DailyConsumptionRollup.status)
+    ).all()
+    counts = {status: int(count) for status, count in rows}
+    return [counts.get(status, 0) for status in STATUSES]
+
+
+def get_most_consumed(criteria):
+    name = db.session.execute(
+        select(Medication.name)
+        .join(DailyConsumptionRollup, DailyConsumptionRollup.medication_id == Medication.id)
+        .where(*criteria)
+        .group_by(Medication.id, Medication.name)
+        .order_by(func.sum(DailyConsumptionRollup.quantity).desc(), Medication.name)
+        .limit(1)
+    ).scalar()
+    return name or 'N/A'
+
+
+def get_series(criteria, start_day, end_day, bucket, label_format):
+    """Return (labels, doses) per bucket, with empty buckets filled in by the database.
+
+    Rollup days are already local calendar days, so truncating them to weeks
+    or months keeps the buckets in the user's time zone.
+    """
+    # bucket comes from BUCKETS, never from the request
+    unit = literal_column(f"'{bucket}'")
+    periods = func.generate_series(
+        func.date_trunc(unit, cast(start_day, DateTime)),
+        cast(end_day, DateTime),
+        literal_column(f"interval '1 {bucket}'")
+    ).table_valued('period').render_derived()
+
+    period = func.date_trunc(unit, cast(DailyConsumptionRollup.day, DateTime))
+    totals = (
+        select(period.label('period'), func.sum(DailyConsumptionRollup.quantity).label('doses'))
+        .where(*criteria)
+        .group_by(period)
+        .subquery()
+    )
+
+    rows = db.session.execute(
+        select(cast(periods.c.period, Date), func.coalesce(totals.c.doses, 0))
+        .select_from(periods)
+        .outerjoin(totals, totals.c.period == periods.c.period)
+        .order_by(periods.c.period)
+    ).all()
+
+    labels = [day.strftime(label_format) for day, _ in rows]
+    doses = [int(total) for _, total in rows]
+    return labels, doses
+
+
+def build_report(user_id, filters):
+    """Compute every aggregate shown on the reports page"""
+    criteria = _rollup_criteria(user_id, filters)
+
+    total_consumption, dose_count, taken_count = get_summary(criteria)
+    adherence_rate = (taken_count / dose_count) * 100 if dose_count else 0
+    bucket, label_format = choose_bucket(filters.start_day, filters.end_day)
+    dates, doses = get_series(criteria, filters.start_day, filters.end_day, bucket, label_format)
+
+    return {
+        'total_consumption': total_consumption,
+        'adherence_rate': adherence_rate,
+        'most_consumed_med': get_most_consumed(criteria),
+        'bucket': bucket,
+        'dates': dates,
+        'daily_doses': doses,
+        'status_distribution': get_status_distribution(criteria)
+    }
+
+
+def get_consumption_page(user_id, filters, cursor=None, limit=RECORDS_PAGE_SIZE):
+    """Return one page of consumption records, newest first, and the cursor for the next page.
+
+    Pages are addressed by the (taken_at, id) of the last row seen, so fetching
+    a deep page costs the same as fetching the first one.
+    """
+    query = (
+        select(
+            Consumption.id,
+            Consumption.taken_at,
+            Consumption.quantity,
+            Consumption.status,
+            Consumption.scheduled_time,
+            Medication.name.label('medication_name')
+        )
+        .join(Medication)
+        .where(*_consumption_criteria(user_id, filters))
+        .order_by(Consumption.taken_at.desc(), Consumption.id.desc())
+        .limit(limit + 1)
+    )
+
+    if cursor:
+        position = decode_cursor(cursor, datetime, int)
+        if position is None:
+            raise ValueError('Invalid cursor')
+        query = query.where(tuple_(Consumption.taken_at, Consumption.id) < tuple_(*position))
+
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].taken_at, rows[-1].id)
+    return rows, next_cursor
@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, make_response, Response, stream_with_context, jsonify, send_file, current_app
 import logging
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 from forms import LoginForm, RegistrationForm, MedicationForm, InventoryUpdateForm, ConsumptionForm, PrescriptionForm
 from models import Medication, InventoryLog, Consumption, Prescription
@@ -9,25 +10,29 @@ from app import db
 import os
 from flask_login import login_required, current_user
 from app import db
-from models import Medication, Consumption, InventoryLog
-from forms import MedicationForm, ConsumptionForm, InventoryUpdateForm
+from models import Medication, Consumption, InventoryLog, PrescriptionBlob
+from forms import MedicationForm, ConsumptionForm, InventoryUpdateForm, BulkConsumptionForm, MedicationImportForm, FREQUENCY_CHOICES
+from reporting import build_report, get_consumption_page, parse_report_filters
+from analytics import build_trends
+from timeline import parse_timeline_filters, get_timeline_page
+from cache import report_cache, bump_user_version, user_etag, conditional_page
+from exports import DATASETS, FORMATS, iter_export
+from dosing import MAX_ITEMS, log_dose, log_doses
+from importer import import_medications
+from sync import MAX_EVENTS, apply_events, parse_sync_cursor, pull_changes
+from storage import blob_store, release_blobs, remove_unreferenced
+from thumbnails import VARIANTS, pipeline
+from expiry import get_expiring_soon
 import logging
 import os
 from werkzeug.utils import secure_filename
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
-# Configure upload folder
-UPLOAD_FOLDER = 'static/uploads/prescriptions'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Create upload directory if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
@@ -35,16 +40,36 @@ def home():
     return redirect(url_for('main.dashboard'))
 
 @main_bp.route('/dashboard')
+@conditional_page('dashboard')
 @login_required
 def dashboard():
     medications = Medication.query.filter_by(user_id=current_user.id).all()
-    medications_dict = [med.to_dict() for med in medications]
+    doses_taken = Medication.get_doses_taken_today_by_medication(current_user)
+    medications_dict = [
+        {**med.to_dict(), 'doses_taken_today': doses_taken.get(med.id, 0)}
+        for med in medications
+    ]
     consumption_form = ConsumptionForm()
+    
+    # Scheduled time slots with more than one medication can be logged in one go
+    slots = {}
+    for med in medications_dict:
+        if med['scheduled_time']:
+            slots.setdefault(med['scheduled_time'], []).append(med['name'])
+    dose_slots = sorted((time, names) for time, names in slots.items() if len(names) > 1)
+    
+    # Precomputed by `flask sweep-expiring`; prescriptions are not scanned here
+    expiring_soon = get_expiring_soon(current_user.id)
+    
     return render_template('dashboard.html', 
                          medications=medications_dict,
-                         consumption_form=consumption_form)
+                         consumption_form=consumption_form,
+                         bulk_form=BulkConsumptionForm(),
+                         dose_slots=dose_slots,
+                         expiring_soon=expiring_soon)
 
 @main_bp.route('/inventory', methods=['GET', 'POST'])
+@conditional_page('inventory')
 @login_required
 def inventory():
     form = MedicationForm()
@@ -79,6 +104,7 @@ def inventory():
             logger.debug("Added inventory log to session")
             
             db.session.commit()
+            bump_user_version(current_user.id)
             logger.info(f"Successfully added medication {medication.name} for user {current_user.id}")
             flash('Medication added successfully!', 'success')
             return redirect(url_for('main.inventory'))
@@ -105,8 +131,46 @@ def inventory():
     return render_template('inventory.html', 
                          form=form,
                          update_form=update_form,
+                         import_form=MedicationImportForm(),
                          medications=medications)
 
+@main_bp.route('/inventory/import', methods=['POST'])
+@login_required
+def import_inventory():
+    form = MedicationImportForm()
+    if not form.validate_on_submit():
+        for field, errors in form.errors.items():
+            for error in errors:
+                flash(f'{getattr(form, field).label.text}: {error}', 'danger')
+        return redirect(url_for('main.inventory'))
+    
+    try:
+        imported, errors = import_medications(
+            current_user.id,
+            form.import_file.data,
+            [value for value, _ in FREQUENCY_CHOICES]
+        )
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        flash(f'Could not read the import file: {str(e)}', 'danger')
+        return redirect(url_for('main.inventory'))
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error importing medications: {str(e)}")
+        flash('An error occurred while importing medications. Please try again.', 'danger')
+        return redirect(url_for('main.inventory'))
+    
+    if imported:
+        bump_user_version(current_user.id)
+        flash(f'Imported {imported} medications.', 'success')
+    if errors:
+        flash(f'{len(errors)} rows were skipped.', 'warning')
+        for line, error in errors[:10]:
+            flash(f'Row {line}: {error}', 'danger')
+    logger.info(f"Imported {imported} medications for user {current_user.id}, {len(errors)} rows rejected")
+    return redirect(url_for('main.inventory'))
+
 @main_bp.route('/update_stock/<int:med_id>', methods=['POST'])
 @login_required
 def update_stock(med_id):
@@ -128,6 +192,7 @@ def update_stock(med_id):
         
         db.session.add(inventory_log)
         db.session.commit()
+        bump_user_version(current_user.id)
         flash('Stock updated successfully!', 'success')
     return redirect(url_for('main.inventory'))
 
@@ -136,28 +201,125 @@ def update_stock(med_id):
 def log_consumption(med_id):
     form = ConsumptionForm()
     if form.validate_on_submit():
-        medication = Medication.query.get_or_404(med_id)
-        if medication.current_stock >= form.quantity.data:
-            consumption = Consumption(
-                medication_id=med_id,
-                quantity=form.quantity.data
-            )
-            medication.current_stock -= form.quantity.data
-            
-            inventory_log = InventoryLog(
-                medication_id=med_id,
-                quantity_change=-form.quantity.data,
-                operation_type='remove'
-            )
-            
-            db.session.add(consumption)
-            db.session.add(inventory_log)
+        remaining_stock = log_dose(current_user, med_id, form.quantity.data)
+        if remaining_stock is not None:
             db.session.commit()
+            bump_user_version(current_user.id)
             flash('Consumption logged successfully!', 'success')
         else:
+            # Nothing was written; tell a missing medication apart from low stock
+            Medication.query.filter_by(id=med_id, user_id=current_user.id).first_or_404()
             flash('Insufficient stock!', 'danger')
     return redirect(url_for('main.dashboard'))
 
+@main_bp.route('/log_consumption/bulk', methods=['POST'])
+@login_required
+def log_consumption_bulk():
+    """Log doses for many medications at once.
+
+    Accepts either JSON {"items": [{"medication_id": 1, "quantity": 1}, ...]}
+    and answers with per-item results, or the dashboard form naming a
+    scheduled_time slot, which logs one dose of every medication in it.
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('items', []), list):
+            return jsonify({'error': 'Expected a JSON object with an items list'}), 400
+        if len(payload.get('items', [])) > MAX_ITEMS:
+            return jsonify({'error': f'At most {MAX_ITEMS} items per request'}), 413
+        try:
+            items = [
+                (int(item['medication_id']), int(item.get('quantity', 1)))
+                for item in payload.get('items', [])
+            ]
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Each item needs an integer medication_id and quantity'}), 400
+        if any(quantity < 1 for _, quantity in items):
+            return jsonify({'error': 'Quantities must be at least 1'}), 400
+    else:
+        form = BulkConsumptionForm()
+        if not form.validate_on_submit():
+            flash('Invalid request.', 'danger')
+            return redirect(url_for('main.dashboard'))
+        medication_ids = db.session.execute(
+            db.select(Medication.id).where(
+                Medication.user_id == current_user.id,
+                Medication.scheduled_time == form.scheduled_time.data
+            )
+        ).scalars()
+        items = [(medication_id, 1) for medication_id in medication_ids]
+    
+    try:
+        results = log_doses(current_user, items)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error logging doses in bulk: {str(e)}")
+        if request.is_json:
+            return jsonify({'error': 'An error occurred while logging doses'}), 500
+        flash('An error occurred while logging doses. Please try again.', 'danger')
+        return redirect(url_for('main.dashboard'))
+    
+    logged = [result for result in results if result['status'] == 'logged']
+    if logged:
+        bump_user_version(current_user.id)
+    
+    if request.is_json:
+        return jsonify({'results': results})
+    
+    if logged:
+        flash(f'Logged {len(logged)} of {len(results)} doses.', 'success')
+    failed = len(results) - len(logged)
+    if failed:
+        flash(f'{failed} doses could not be logged due to insufficient stock.', 'danger')
+    return redirect(url_for('main.dashboard'))
+
+@main_bp.route('/api/sync', methods=['GET', 'POST'])
+@login_required
+def sync():
+    """Offline sync endpoint.
+
+    GET returns the changes since ?cursor=. POST takes
+    {"cursor": ..., "events": [{"idempotency_key", "medication_id", "quantity",
+    "taken_at", "status"}, ...]}, applies the events and answers with per-event
+    results plus the changes since the cursor, including the rows just applied.
+    """
+    cursor = request.args.get('cursor')
+    results = None
+    
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('events', []), list):
+            return jsonify({'error': 'Expected a JSON object with an events list'}), 400
+        events = payload.get('events', [])
+        if len(events) > MAX_EVENTS:
+            return jsonify({'error': f'At most {MAX_EVENTS} events per request'}), 413
+        cursor = payload.get('cursor')
+    
+    # Checked before any event is applied, so a bad cursor leaves nothing committed
+    try:
+        position = parse_sync_cursor(cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if request.method == 'POST':
+        try:
+            results = apply_events(current_user, events)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error applying sync events: {str(e)}")
+            return jsonify({'error': 'An error occurred while applying events'}), 500
+        
+        if any(result['status'] == 'applied' for result in results):
+            bump_user_version(current_user.id)
+    
+    changes = pull_changes(current_user, position)
+    
+    if results is not None:
+        changes['results'] = results
+    return jsonify(changes)
+
 @main_bp.route('/upload_prescription/<int:med_id>', methods=['GET', 'POST'])
 @login_required
 def upload_prescription(med_id):
@@ -168,47 +330,152 @@ def upload_prescription(med_id):
     
     form = PrescriptionForm()
     if form.validate_on_submit():
+        sha256 = None
         try:
             file = form.prescription_file.data
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(file_path)
+                # Stored under its content hash, so identical uploads share one file
+                sha256, size = blob_store.save(file.stream)
+                # Type identified from the file's magic bytes while it was uploaded
+                content_type = getattr(file.stream, 'detected_type', None) or file.mimetype
+                PrescriptionBlob.acquire(sha256, size, content_type)
                 
                 prescription = Prescription(
                     medication_id=med_id,
                     file_name=filename,
-                    file_path=file_path,
+                    file_path=blob_store.relative_path(sha256),
+                    blob_sha256=sha256,
                     expiry_date=form.expiry_date.data,
                     notes=form.notes.data
                 )
                 
                 db.session.add(prescription)
                 db.session.commit()
+                bump_user_version(current_user.id)
+                if prescription.is_image:
+                    pipeline.schedule(sha256)
                 flash('Prescription uploaded successfully!', 'success')
                 return redirect(url_for('main.inventory'))
             else:
                 flash('Invalid file type. Please upload a PDF or image file.', 'danger')
         except Exception as e:
             db.session.rollback()
+            if sha256:
+                remove_unreferenced([sha256])
             logger.error(f"Error uploading prescription: {str(e)}")
             flash('An error occurred while uploading the prescription.', 'danger')
     
-    return render_template('upload_prescription.html', form=form, medication=medication)
+    prescriptions = Prescription.query.options(joinedload(Prescription.blob)).filter_by(
+        medication_id=med_id
+    ).order_by(Prescription.upload_date.desc()).all()
+    
+    return render_template('upload_prescription.html',
+                         form=form,
+                         medication=medication,
+                         prescriptions=prescriptions)
+
+def _owned_prescription(prescription_id):
+    """Return one of the current user's prescriptions or abort with 404"""
+    return Prescription.query.join(Medication).options(joinedload(Prescription.blob)).filter(
+        Prescription.id == prescription_id,
+        Medication.user_id == current_user.id
+    ).first_or_404()
+
+@main_bp.route('/prescriptions/<int:prescription_id>')
+@login_required
+def download_prescription(prescription_id):
+    """Serve an uploaded prescription file to its owner.
+
+    Range requests are honoured, so large PDFs can be viewed page by page.
+    Behind nginx, set PRESCRIPTION_ACCEL_REDIRECT to an internal location
+    aliased to the blob store and nginx sends the file itself; USE_X_SENDFILE
+    does the same for Apache and lighttpd.
+    """
+    prescription = _owned_prescription(prescription_id)
+    as_attachment = request.args.get('download') == '1'
+    
+    if prescription.blob is None:
+        # Uploaded before the blob store; served from its original location
+        if not os.path.isfile(prescription.file_path):
+            abort(404)
+        return send_file(prescription.file_path, download_name=prescription.file_name,
+                         as_attachment=as_attachment, conditional=True)
+    
+    blob = prescription.blob
+    accel_prefix = current_app.config.get('PRESCRIPTION_ACCEL_REDIRECT')
+    if accel_prefix:
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + blob_store.relative_path(blob.sha256)
+        response.headers['Content-Type'] = blob.content_type or 'application/octet-stream'
+        response.headers['Content-Disposition'] = (
+            f'{"attachment" if as_attachment else "inline"}; filename="{prescription.file_name}"'
+        )
+        response.set_etag(blob.sha256)
+    else:
+        # With a file path, the WSGI server can hand the file to sendfile()
+        # instead of copying it through Python
+        response = send_file(blob_store.path(blob.sha256), mimetype=blob.content_type,
+                             download_name=prescription.file_name, as_attachment=as_attachment,
+                             conditional=True, etag=blob.sha256)
+    # Contents are addressed by hash and never change for a prescription
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+@main_bp.route('/prescriptions/<int:prescription_id>/<variant>')
+@login_required
+def prescription_image(prescription_id, variant):
+    """Serve a downsized copy of a prescription image, generating it on first request"""
+    if variant not in VARIANTS:
+        abort(404)
+    prescription = _owned_prescription(prescription_id)
+    if not prescription.is_image:
+        abort(404)
+    
+    try:
+        path = pipeline.get(prescription.blob_sha256, variant)
+    except Exception:
+        abort(404)
+    
+    response = send_file(path, mimetype=VARIANTS[variant][3], conditional=True,
+                         etag=f'{prescription.blob_sha256}-{variant}')
+    # A prescription's file never changes, so neither does this URL's content
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
 
 @main_bp.route('/history')
+@conditional_page('history')
 @login_required
 def history():
-    medications = Medication.query.filter_by(user_id=current_user.id).all()
-    return render_template('history.html', medications=medications)
+    try:
+        filters = parse_timeline_filters(request.args, current_user.zone)
+        events, next_cursor = get_timeline_page(
+            current_user.id, filters, cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        abort(400)
+    
+    # Medications for the filter dropdown
+    medications = Medication.query.filter_by(user_id=current_user.id).order_by(Medication.name).all()
+    
+    return render_template('history.html',
+                         events=events,
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         medications=medications)
 
 @main_bp.route('/medication/<int:med_id>/delete', methods=['POST'])
 @login_required
 def delete_medication(med_id):
     medication = Medication.query.filter_by(id=med_id, user_id=current_user.id).first_or_404()
     try:
+        hashes = [prescription.blob_sha256 for prescription in medication.prescriptions if prescription.blob_sha256]
         db.session.delete(medication)
+        db.session.flush()
+        released = release_blobs(hashes)
         db.session.commit()
+        remove_unreferenced(released)
+        bump_user_version(current_user.id)
         flash('Medication deleted successfully', 'success')
     except Exception as e:
         db.session.rollback()
@@ -216,85 +483,115 @@ def delete_medication(med_id):
     return redirect(url_for('main.inventory'))
 
 
+def _report_filters():
+    """Read the date range and medication filters shared by the report views"""
+    try:
+        return parse_report_filters(request.args, current_user.zone)
+    except (ValueError, OverflowError):
+        abort(400)
+
 @main_bp.route('/reports')
 @login_required
 def reports():
-    from datetime import datetime, timedelta
-    from sqlalchemy import func
-    
     # Get filter parameters
-    date_range = request.args.get('date_range', '7')
-    medication_id = request.args.get('medication_id', '')
-    
-    # Calculate date range
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=int(date_range))
-    
-    # Base query for consumption records
-    query = db.session.query(Consumption).join(Medication).\
-        filter(Medication.user_id == current_user.id).\
-        filter(Consumption.taken_at >= start_date)
-    
-    if medication_id:
-        query = query.filter(Medication.id == medication_id)
-    
-    # Get consumption records
-    consumption_records = query.order_by(Consumption.taken_at.desc()).all()
-    
-    # Calculate summary statistics
-    total_consumption = sum(record.quantity for record in consumption_records)
-    
-    # Calculate adherence rate
-    adherence_rate = 0
-    if consumption_records:
-        taken_count = len([r for r in consumption_records if r.status == 'taken'])
-        adherence_rate = (taken_count / len(consumption_records)) * 100
-    
-    # Get most consumed medication
-    med_consumption = {}
-    for record in consumption_records:
-        med_name = record.medication.name
-        med_consumption[med_name] = med_consumption.get(med_name, 0) + record.quantity
-    
-    most_consumed_med = max(med_consumption.items(), key=lambda x: x[1])[0] if med_consumption else 'N/A'
-    
-    # Prepare data for trend chart
-    dates = []
-    daily_doses = []
-    current_date = start_date
-    while current_date <= end_date:
-        dates.append(current_date.strftime('%Y-%m-%d'))
-        day_doses = sum(
-            record.quantity
-            for record in consumption_records
-            if record.taken_at.date() == current_date.date()
-        )
-        daily_doses.append(day_doses)
-        current_date += timedelta(days=1)
-    
-    # Calculate status distribution
-    status_counts = {'taken': 0, 'missed': 0, 'skipped': 0}
-    for record in consumption_records:
-        status_counts[record.status] = status_counts.get(record.status, 0) + 1
-    status_distribution = [
-        status_counts.get('taken', 0),
-        status_counts.get('missed', 0),
-        status_counts.get('skipped', 0)
-    ]
+    filters = _report_filters()
+    
+    # Only the first page of detailed records is rendered; the rest is
+    # fetched on demand from main.report_records
+    consumption_records, next_cursor = get_consumption_page(current_user.id, filters)
     
     # Get all medications for the filter dropdown
     medications = Medication.query.filter_by(user_id=current_user.id).all()
     
+    # Summary cards and charts are filled in from main.report_series
     return render_template(
         'reports.html',
         medications=medications,
         consumption_records=consumption_records,
-        total_consumption=total_consumption,
-        adherence_rate=adherence_rate,
-        most_consumed_med=most_consumed_med,
-        dates=dates,
-        daily_doses=daily_doses,
-        status_distribution=status_distribution,
-        date_range=date_range,
-        medication_id=medication_id
-    )
\ No newline at end of file
+        next_cursor=next_cursor,
+        filters=filters,
+        date_range=filters.date_range,
+        medication_id=filters.medication_id
+    )
+
+@main_bp.route('/api/reports/series')
+@login_required
+def report_series():
+    filters = _report_filters()
+    params = (filters.start_day, filters.end_day, filters.medication_id)
+    
+    # Answer revalidation before touching the database
+    etag = user_etag(current_user.id, 'series', *params)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        # Summary statistics and chart series are aggregated in SQL and cached
+        # until the user's data changes
+        report = report_cache.get_or_compute(
+            current_user.id,
+            params,
+            lambda: build_report(current_user.id, filters)
+        )
+        response = jsonify(report)
+    
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@main_bp.route('/api/reports/trends')
+@login_required
+def report_trends():
+    filters = _report_filters()
+    params = ('trends', filters.end_day, filters.medication_id)
+    
+    etag = user_etag(current_user.id, *params)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        trends = report_cache.get_or_compute(
+            current_user.id,
+            params,
+            lambda: build_trends(current_user, filters)
+        )
+        response = jsonify(trends)
+    
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@main_bp.route('/reports/records')
+@login_required
+def report_records():
+    filters = _report_filters()
+    try:
+        consumption_records, next_cursor = get_consumption_page(
+            current_user.id, filters, cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        abort(400)
+    
+    response = make_response(render_template(
+        '_consumption_rows.html',
+        consumption_records=consumption_records
+    ))
+    response.headers['X-Next-Cursor'] = next_cursor or ''
+    return response
+
+@main_bp.route('/export/<dataset>')
+@login_required
+def export(dataset):
+    fmt = request.args.get('format', 'csv')
+    if dataset not in DATASETS or fmt not in FORMATS:
+        abort(404)
+    
+    filters = _report_filters()
+    filename = f"medtracker_{dataset}_{filters.end_day.strftime('%Y%m%d')}.{fmt}"
+    
+    response = Response(
+        stream_with_context(iter_export(dataset, fmt, current_user.id, filters, current_user.zone)),
+        mimetype=FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -3,4 +3,4 @@ from app import create_app
 app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=4200, debug=True)
+    app.run(host="0.0.0.0", port=4200, debug=not app.config["PRODUCTION"])
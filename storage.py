@@ -0,0 +1,139 @@
+"""Content-addressed file storage for prescription uploads.
+
+A file is stored once under the SHA-256 of its contents, sharded two levels
+deep (ab/cd/abcd...) so no directory grows too large. Files are written to
+a temporary file in the store while being hashed and then renamed into
+place, so nothing holds the whole file in memory and a half-written file is
+never visible under its final name. Uploads go through a BlobWriter that the
+request parser writes into directly, so each upload touches the disk once.
+Uploading a file that is already stored costs no extra disk.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobWriter:
+    """Temporary file in a BlobStore, hashed as it is written.
+
+    commit() moves it to its content address; closing it without committing
+    deletes it.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        # Same filesystem as the blobs, so the final rename is atomic
+        fd, self._temp_path = tempfile.mkstemp(dir=os.path.join(store.root, 'tmp'))
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self._size = 0
+        self._stored = None
+
+    def write(self, data):
+        self._digest.update(data)
+        self._size += len(data)
+        return self._file.write(data)
+
+    def commit(self):
+        """Move the file into the store; returns (sha256, size)"""
+        if self._stored is None:
+            self._file.flush()
+            sha256 = self._digest.hexdigest()
+            target = self._store.path(sha256)
+            if os.path.exists(target):
+                os.remove(self._temp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(self._temp_path, target)
+            self._stored = (sha256, self._size)
+        return self._stored
+
+    def close(self):
+        self._file.close()
+        if self._stored is None and os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class BlobStore:
+    """Files on disk keyed by the SHA-256 of their contents"""
+
+    def __init__(self, root=None):
+        self.root = root
+
+    def init_app(self, app):
+        self.root = app.config.get('PRESCRIPTION_STORAGE') or os.path.join(app.instance_path, 'prescriptions')
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+
+    def relative_path(self, sha256):
+        return os.path.join(sha256[:2], sha256[2:4], sha256)
+
+    def path(self, sha256):
+        return os.path.join(self.root, self.relative_path(sha256))
+
+    def exists(self, sha256):
+        return os.path.isfile(self.path(sha256))
+
+    def writer(self):
+        return BlobWriter(self)
+
+    def save(self, stream):
+        """Store a readable binary stream; returns (sha256, size)"""
+        # Streams the upload parser already wrote into the store only need moving
+        if hasattr(stream, 'commit'):
+            return stream.commit()
+        with self.writer() as writer:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                writer.write(chunk)
+            return writer.commit()
+
+    def delete(self, sha256):
+        """Remove a stored file and every derivative generated from it"""
+        from thumbnails import VARIANTS, pipeline
+        for path in [self.path(sha256)] + [pipeline.path(sha256, variant) for variant in VARIANTS]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def release_blobs(hashes):
+    """Drop one reference to each blob hash, held by prescriptions already deleted.
+
+    The prescription rows must be flushed first, since a blob row cannot be
+    deleted while a prescription still points at it. Returns the hashes no
+    longer referenced; pass them to remove_unreferenced after the
+    transaction commits.
+    """
+    from models import PrescriptionBlob
+    return [sha256 for sha256 in hashes if PrescriptionBlob.release(sha256)]
+
+
+def remove_unreferenced(hashes):
+    """Delete blob files whose rows are gone; call after committing"""
+    from app import db
+    from models import PrescriptionBlob
+    for sha256 in hashes:
+        # A new upload of the same file may have referenced it again meanwhile
+        if db.session.get(PrescriptionBlob, sha256) is None:
+            blob_store.delete(sha256)
+            logger.info(f"Removed unreferenced prescription blob {sha256}")
+
+
+blob_store = BlobStore()
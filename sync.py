@@ -0,0 +1,288 @@
+"""Offline dose sync: idempotent event upload and delta pulls.
+
+Clients queue dose events while offline, each with a client-generated
+idempotency key and the time it actually happened, and upload them in
+batches. Events whose key was already seen are acknowledged without being
+applied again, so a retried upload is harmless. Pulls return only the rows
+changed since the client's last cursor, ordered by the transaction that
+wrote them so rows committed late are not skipped.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Integer, column, insert, select, update, values, func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app import db
+from models import Medication, Consumption, InventoryLog, DailyConsumptionRollup
+from pagination import encode_cursor, decode_cursor
+from reporting import STATUSES
+from timeutils import local_day
+
+MAX_EVENTS = 500
+PULL_LIMIT = 500
+KEY_LENGTH = 64
+# Largest value of the integer quantity column
+MAX_QUANTITY = 2 ** 31 - 1
+# How far ahead of the server a device clock may run
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+def _parse_taken_at(value):
+    """Return an ISO 8601 timestamp as naive UTC; naive input is taken as UTC"""
+    taken_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if taken_at.tzinfo is not None:
+        taken_at = taken_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return taken_at
+
+
+def _validate_event(event, owned, zone):
+    key = event.get('idempotency_key')
+    if not isinstance(key, str) or not key or len(key) > KEY_LENGTH:
+        raise ValueError(f'idempotency_key must be 1 to {KEY_LENGTH} characters')
+    try:
+        medication_id = int(event['medication_id'])
+        quantity = int(event.get('quantity', 1))
+        taken_at = _parse_taken_at(event['taken_at'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('medication_id, quantity and an ISO 8601 taken_at are required')
+    except OverflowError:
+        raise ValueError('taken_at is out of range')
+    try:
+        # The rollup day does not exist for instants at the ends of the calendar
+        local_day(taken_at, zone)
+    except OverflowError:
+        raise ValueError('taken_at is out of range')
+    if not 1 <= quantity <= MAX_QUANTITY:
+        raise ValueError(f'quantity must be between 1 and {MAX_QUANTITY}')
+    status = event.get('status', 'taken')
+    if status not in STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(STATUSES)}")
+    if taken_at > datetime.utcnow() + CLOCK_SKEW:
+        raise ValueError('taken_at is in the future')
+    if medication_id not in owned:
+        raise LookupError('Medication not found')
+    return {
+        'idempotency_key': key,
+        'medication_id': medication_id,
+        'quantity': quantity,
+        'taken_at': taken_at,
+        'scheduled_time': owned[medication_id],
+        'status': status
+    }
+
+
+def apply_events(user, events):
+    """Record a batch of queued dose events.
+
+    Every event is inserted with INSERT ... ON CONFLICT DO NOTHING on its
+    (medication_id, idempotency_key), and only the rows actually inserted
+    decrement stock, write inventory logs and update the rollups. Returns one
+    result per event: applied, duplicate, invalid or not_found. The caller
+    commits.
+    """
+    owned = dict(db.session.execute(
+        select(Medication.id, Medication.scheduled_time).where(Medication.user_id == user.id)
+    ).all())
+
+    results = []
+    # Keys are scoped to their medication; scopes[i] is None for rejected events
+    scopes = []
+    pending = OrderedDict()
+    for event in events:
+        key = event.get('idempotency_key') if isinstance(event, dict) else None
+        try:
+            if not isinstance(event, dict):
+                raise ValueError('Each event must be an object')
+            row = _validate_event(event, owned, user.zone)
+        except ValueError as e:
+            results.append({'idempotency_key': key, 'status': 'invalid', 'error': str(e)})
+            scopes.append(None)
+            continue
+        except LookupError as e:
+            results.append({'idempotency_key': key, 'status': 'not_found', 'error': str(e)})
+            scopes.append(None)
+            continue
+        scope = (row['medication_id'], row['idempotency_key'])
+        results.append({'idempotency_key': row['idempotency_key'], 'status': 'duplicate'})
+        scopes.append(scope)
+        # The first occurrence of a key within a batch wins
+        pending.setdefault(scope, row)
+
+    inserted = []
+    if pending:
+        inserted = db.session.execute(
+            pg_insert(Consumption)
+            .values(list(pending.values()))
+            .on_conflict_do_nothing(index_elements=['medication_id', 'idempotency_key'])
+            .returning(Consumption.medication_id, Consumption.idempotency_key)
+        ).all()
+    inserted = [tuple(scope) for scope in inserted]
+    applied = [pending[scope] for scope in inserted]
+
+    taken = OrderedDict()
+    for row in applied:
+        if row['status'] == 'taken':
+            taken[row['medication_id']] = taken.get(row['medication_id'], 0) + row['quantity']
+    if taken:
+        doses = values(
+            column('medication_id', Integer),
+            column('quantity', Integer),
+            name='doses'
+        ).data(list(taken.items()))
+        # These doses already happened, so stock is clamped at zero rather
+        # than refusing the event the way a live dose would be refused
+        db.session.execute(
+            update(Medication)
+            .where(Medication.id == doses.c.medication_id, Medication.user_id == user.id)
+            .values(current_stock=func.greatest(Medication.current_stock - doses.c.quantity, 0))
+        )
+        db.session.execute(insert(InventoryLog), [
+            {
+                'medication_id': row['medication_id'],
+                'quantity_change': -row['quantity'],
+                'operation_type': 'remove',
+                'timestamp': row['taken_at']
+            }
+            for row in applied if row['status'] == 'taken'
+        ])
+
+    rollups = OrderedDict()
+    for row in applied:
+        rollup_key = (row['medication_id'], local_day(row['taken_at'], user.zone), row['status'])
+        quantity, dose_count = rollups.get(rollup_key, (0, 0))
+        rollups[rollup_key] = (quantity + row['quantity'], dose_count + 1)
+    DailyConsumptionRollup.increment_many([
+        {
+            'user_id': user.id,
+            'medication_id': medication_id,
+            'day': day,
+            'status': status,
+            'quantity': quantity,
+            'dose_count': dose_count
+        }
+        for (medication_id, day, status), (quantity, dose_count) in rollups.items()
+    ])
+
+    inserted = set(inserted)
+    for result, scope in zip(results, scopes):
+        if scope in inserted:
+            result['status'] = 'applied'
+            # A key repeated within the batch is only applied once
+            inserted.discard(scope)
+    return results
+
+
+def parse_sync_cursor(cursor):
+    """Decode a sync cursor; raises ValueError if it is malformed"""
+    if not cursor:
+        return 0, 0, 0, 0, 0
+    position = decode_cursor(cursor, int, int, int, int, int)
+    if position is None:
+        raise ValueError('Invalid cursor')
+    return position
+
+
+def _stable_xid():
+    """Oldest transaction still running; every lower one has committed or aborted"""
+    return db.session.execute(select(func.txid_snapshot_xmin(func.txid_current_snapshot()))).scalar()
+
+
+def _next_position(rows, position, stable, limit):
+    """Return the (change_xid, id) to resume a table from, and whether it has more rows.
+
+    Rows from transactions at or after stable may still be joined by rows of
+    transactions that commit later, so the cursor never moves past stable and
+    those rows are sent again on the next pull.
+    """
+    if len(rows) == limit and rows[-1].change_xid < stable:
+        return (rows[-1].change_xid, rows[-1].id), True
+    return max(position, (stable, 0)), False
+
+
+def pull_changes(user, position, limit=PULL_LIMIT):
+    """Return the rows changed since a parsed sync cursor and the cursor to send next time.
+
+    Every row carries the id of the transaction that last wrote it. Tables
+    are read from the cursor's (change_xid, id) position, so rows are picked
+    up in commit-safe order; rows written by transactions that were still
+    running may be sent more than once and clients apply them by id. The
+    full list of medication ids is always included so clients can drop
+    medications, and their history, deleted on the server.
+    """
+    consumption_xid, consumption_id, inventory_xid, inventory_id, medication_xid = position
+    # Read before the rows, so everything below it is already visible to them
+    stable = _stable_xid()
+
+    medications = Medication.query.filter(
+        Medication.user_id == user.id,
+        Medication.change_xid >= medication_xid
+    ).order_by(Medication.change_xid, Medication.id).populate_existing().all()
+    medication_ids = db.session.execute(
+        select(Medication.id).where(Medication.user_id == user.id).order_by(Medication.id)
+    ).scalars().all()
+
+    consumptions = db.session.execute(
+        select(
+            Consumption.id, Consumption.medication_id, Consumption.taken_at, Consumption.quantity,
+            Consumption.scheduled_time, Consumption.status, Consumption.idempotency_key,
+            Consumption.change_xid
+        )
+        .join(Medication)
+        .where(
+            Medication.user_id == user.id,
+            Consumption.change_xid >= consumption_xid,
+            tuple_(Consumption.change_xid, Consumption.id) > tuple_(consumption_xid, consumption_id)
+        )
+        .order_by(Consumption.change_xid, Consumption.id)
+        .limit(limit)
+    ).all()
+    inventory_logs = db.session.execute(
+        select(
+            InventoryLog.id, InventoryLog.medication_id, InventoryLog.quantity_change,
+            InventoryLog.operation_type, InventoryLog.timestamp, InventoryLog.change_xid
+        )
+        .join(Medication)
+        .where(
+            Medication.user_id == user.id,
+            InventoryLog.change_xid >= inventory_xid,
+            tuple_(InventoryLog.change_xid, InventoryLog.id) > tuple_(inventory_xid, inventory_id)
+        )
+        .order_by(InventoryLog.change_xid, InventoryLog.id)
+        .limit(limit)
+    ).all()
+
+    (consumption_xid, consumption_id), more_consumptions = _next_position(
+        consumptions, (consumption_xid, consumption_id), stable, limit
+    )
+    (inventory_xid, inventory_id), more_inventory_logs = _next_position(
+        inventory_logs, (inventory_xid, inventory_id), stable, limit
+    )
+    medication_xid = max(medication_xid, stable)
+
+    return {
+        'cursor': encode_cursor(consumption_xid, consumption_id, inventory_xid, inventory_id, medication_xid),
+        'has_more': more_consumptions or more_inventory_logs,
+        'medication_ids': medication_ids,
+        'medications': [medication.to_sync_dict() for medication in medications],
+        'consumptions': [
+            {
+                'id': row.id,
+                'medication_id': row.medication_id,
+                'taken_at': row.taken_at.isoformat(),
+                'quantity': row.quantity,
+                'scheduled_time': row.scheduled_time,
+                'status': row.status,
+                'idempotency_key': row.idempotency_key
+            }
+            for row in consumptions
+        ],
+        'inventory_logs': [
+            {
+                'id': row.id,
+                'medication_id': row.medication_id,
+                'quantity_change': row.quantity_change,
+                'operation_type': row.operation_type,
+                'timestamp': row.timestamp.isoformat()
+            }
+            for row in inventory_logs
+        ]
+    }
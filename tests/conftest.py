@@ -0,0 +1,119 @@
+"""Fixtures running the app against a throwaway PostgreSQL database.
+
+Set TEST_DATABASE_URL to use an existing server (its public schema is
+dropped and rebuilt from the migrations); otherwise a private server is
+started with pgserver when it is installed, and the tests are skipped when
+neither is available.
+"""
+import os
+import pytest
+from sqlalchemy import event, text
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def database_url(tmp_path_factory):
+    url = os.environ.get('TEST_DATABASE_URL')
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip('pgserver', reason='set TEST_DATABASE_URL or install pgserver')
+    server = pgserver.get_server(str(tmp_path_factory.mktemp('pgdata')), cleanup_mode='stop')
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(scope='session')
+def app(database_url, tmp_path_factory):
+    os.environ['PRESCRIPTION_STORAGE'] = str(tmp_path_factory.mktemp('prescriptions'))
+    from flask_migrate import upgrade
+    from app import create_app, db
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_pre_ping': True}
+    })
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP SCHEMA public CASCADE'))
+            connection.execute(text('CREATE SCHEMA public'))
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+    yield app
+
+
+@pytest.fixture
+def session(app):
+    """Database session inside an app context; every table is emptied afterwards"""
+    from app import db
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
+        tables = ', '.join(f'"{table.name}"' for table in db.metadata.sorted_tables)
+        # Ids keep counting up, so per-user cache entries from earlier tests never match
+        db.session.execute(text(f'TRUNCATE {tables} CASCADE'))
+        db.session.commit()
+
+
+@pytest.fixture
+def user(session):
+    from models import User
+    user = User(
+        username='alice',
+        email='alice@example.com',
+        password_hash=generate_password_hash('password'),
+        timezone='Europe/Berlin'
+    )
+    session.add(user)
+    session.commit()
+    return user
+
+
+@pytest.fixture
+def make_medication(session, user):
+    """Return a factory committing a medication, owned by user unless owner is given"""
+    from models import Medication
+
+    def make(name='Aspirin', owner=None, **fields):
+        medication = Medication(**{
+            'name': name,
+            'dosage': '100mg',
+            'frequency': 'daily',
+            'current_stock': 10,
+            'user_id': (owner or user).id,
+            'scheduled_time': '08:00',
+            **fields
+        })
+        session.add(medication)
+        session.commit()
+        return medication
+
+    return make
+
+
+@pytest.fixture
+def client(app, user):
+    """Test client logged in as user"""
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['_user_id'] = str(user.id)
+        flask_session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def queries(app):
+    """Statements run while the test uses it, recorded through before_cursor_execute"""
+    from app import db
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
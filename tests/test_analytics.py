@@ -0,0 +1,74 @@
+"""Adherence statistics on small synthetic histories."""
+import numpy as np
+import pytest
+from analytics import (
+    STATUS_CODES, SECONDS_PER_DAY, ConsumptionHistory,
+    rolling_adherence, schedule_deviation, streaks, weekly_trends
+)
+
+DAY = 20000
+
+
+def _history(records, medications):
+    """records: (day, 'HH:MM', medication index, quantity, status)"""
+    def epoch(day, clock):
+        hours, minutes = clock.split(':')
+        return day * SECONDS_PER_DAY + int(hours) * 3600 + int(minutes) * 60
+
+    return ConsumptionHistory(
+        local_epoch=np.array([epoch(day, clock) for day, clock, _, _, _ in records], dtype=np.int64),
+        medication_index=np.array([index for _, _, index, _, _ in records], dtype=np.int32),
+        quantity=np.array([quantity for _, _, _, quantity, _ in records], dtype=np.int32),
+        status=np.array([STATUS_CODES[status] for _, _, _, _, status in records], dtype=np.int8),
+        medications=[(i + 1, f'Medication {i}', scheduled) for i, scheduled in enumerate(medications)]
+    )
+
+
+def test_rolling_adherence():
+    taken = np.array([0, 1, 0, 2, 0], dtype=np.float64)
+    logged = np.array([0, 1, 1, 2, 0], dtype=np.float64)
+    np.testing.assert_allclose(
+        rolling_adherence(taken, logged, 2),
+        [np.nan, 100, 50, 2 / 3 * 100, 100]
+    )
+
+
+@pytest.mark.parametrize('taken, logged, expected', [
+    ([1, 1, 0, 1, 1, 1], [1, 1, 1, 1, 1, 1], (3, 3)),
+    # Nothing logged yet today keeps yesterday's streak
+    ([1, 1, 0, 1, 1, 0], [1, 1, 1, 1, 1, 0], (2, 2)),
+    # Two empty days in a row do break it
+    ([1, 1, 0, 1, 1, 0, 0], [1, 1, 1, 1, 1, 0, 0], (2, 0)),
+    ([1, 1, 1, 0], [1, 1, 1, 1], (3, 0)),
+    ([2, 1], [2, 2], (1, 0)),
+    ([0, 0], [0, 0], (0, 0)),
+    ([], [], (0, 0))
+])
+def test_streaks(taken, logged, expected):
+    assert streaks(np.array(taken, dtype=np.float64), np.array(logged, dtype=np.float64)) == expected
+
+
+def test_schedule_deviation_wraps_around_midnight():
+    history = _history([
+        # 20 minutes early across midnight, then 10 minutes late
+        (DAY, '23:50', 0, 1, 'taken'),
+        (DAY + 1, '00:20', 0, 1, 'taken'),
+        (DAY, '08:30', 1, 1, 'taken'),
+        # Missed doses do not count
+        (DAY + 1, '12:00', 1, 1, 'missed'),
+        (DAY, '09:00', 2, 1, 'taken')
+    ], ['00:10', '08:00', None])
+    np.testing.assert_allclose(schedule_deviation(history), [15, 30, np.nan])
+
+
+def test_weekly_trends():
+    weeks = 4
+    records = []
+    for week in range(weeks):
+        # Medication 0 rises by one dose a week; medication 1 stays flat
+        records.append((DAY - 7 * week, '08:00', 0, weeks - week, 'taken'))
+        records.append((DAY - 7 * week, '08:00', 1, 2, 'taken'))
+    # Outside the fitted window
+    records.append((DAY - 7 * weeks, '08:00', 1, 50, 'taken'))
+    history = _history(records, ['08:00', '08:00'])
+    np.testing.assert_allclose(weekly_trends(history, DAY, weeks), [1, 0])
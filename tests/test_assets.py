@@ -0,0 +1,31 @@
+"""Fingerprinted static assets are served in an encoding the client accepts."""
+import pytest
+from flask import Flask, url_for
+import assets
+
+
+@pytest.fixture
+def static_app(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'style.css').write_text('body { color: black; }\n' * 50)
+    app = Flask(__name__, static_folder=str(tmp_path))
+    app.config['ASSETS_FINGERPRINT'] = True
+    assets.init_app(app)
+    with app.test_request_context():
+        url = url_for('static', filename='css/style.css')
+    return app.test_client(), url
+
+
+def test_asset_is_served_in_the_negotiated_encoding(static_app):
+    client, url = static_app
+    response = client.get(url, headers={'Accept-Encoding': 'gzip;q=1, br;q=0.1'})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_asset_is_served_uncompressed_when_every_encoding_is_refused(static_app):
+    client, url = static_app
+    response = client.get(url, headers={'Accept-Encoding': 'br;q=0, gzip;q=0'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
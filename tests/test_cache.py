@@ -0,0 +1,23 @@
+"""Page ETags change when the user's data does."""
+import pytest
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/log_consumption/bulk', lambda m: {'items': [{'medication_id': m.id, 'quantity': 5}]}),
+    ('/api/sync', lambda m: {'events': [{
+        'idempotency_key': 'dose-1', 'medication_id': m.id, 'quantity': 5,
+        'taken_at': '2026-06-01T08:00:00Z'
+    }]})
+])
+def test_write_changes_the_dashboard_etag(client, make_medication, path, payload):
+    medication = make_medication(current_stock=100)
+    first = client.get('/dashboard')
+    etag = first.headers['ETag']
+    assert client.get('/dashboard', headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.post(path, json=payload(medication)).status_code == 200
+
+    response = client.get('/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert b'95' in response.data
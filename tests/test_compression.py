@@ -0,0 +1,59 @@
+"""Response compression."""
+import pytest
+from flask import Flask
+from flask_wtf.csrf import generate_csrf
+from werkzeug.http import parse_accept_header
+from compression import ResponseCompressor, negotiate_encoding
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    ResponseCompressor().init_app(app)
+
+    @app.route('/data')
+    def data():
+        return {'values': list(range(500))}
+
+    @app.route('/page')
+    def page():
+        return '<p>' + 'text ' * 500 + '</p>'
+
+    @app.route('/form')
+    def form():
+        return f'<form><input name="csrf_token" value="{generate_csrf()}">' + 'text ' * 500 + '</form>'
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize('accept, supported, encoding', [
+    ('gzip', ('br', 'gzip'), 'gzip'),
+    ('gzip, br', ('br', 'gzip'), 'br'),
+    ('gzip;q=1, br;q=0.1', ('br', 'gzip'), 'gzip'),
+    ('br;q=0, gzip', ('br', 'gzip'), 'gzip'),
+    ('br;q=0, gzip;q=0', ('br', 'gzip'), None),
+    ('*', ('br', 'gzip'), 'br'),
+    ('*, br;q=0', ('br', 'gzip'), 'gzip'),
+    ('br', ('gzip',), None),
+    ('identity', ('br', 'gzip'), None),
+    ('', ('br', 'gzip'), None)
+])
+def test_negotiate_encoding(accept, supported, encoding):
+    assert negotiate_encoding(parse_accept_header(accept), supported) == encoding
+
+
+def test_json_is_compressed_with_the_negotiated_encoding(client):
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip;q=1, br;q=0.1'})
+    assert response.headers.get('Content-Encoding') == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_html_is_compressed(client):
+    assert client.get('/page', headers={'Accept-Encoding': 'gzip'}).headers.get('Content-Encoding') == 'gzip'
+
+
+def test_html_carrying_a_csrf_token_is_not_compressed(client):
+    response = client.get('/form', headers={'Accept-Encoding': 'gzip, br'})
+    assert 'Content-Encoding' not in response.headers
+    assert b'csrf_token' in response.data
@@ -0,0 +1,54 @@
+"""Dose logging endpoints."""
+import pytest
+from dosing import MAX_ITEMS
+from models import Consumption
+
+
+@pytest.mark.parametrize('body', ['[]', '"items"', '3', 'null', '{"items": {"medication_id": 1}}'])
+def test_bulk_rejects_payloads_that_are_not_an_items_object(client, body):
+    response = client.post('/log_consumption/bulk', data=body, content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_bulk_caps_the_number_of_items(client):
+    items = [{'medication_id': 1}] * (MAX_ITEMS + 1)
+    response = client.post('/log_consumption/bulk', json={'items': items})
+    assert response.status_code == 413
+
+
+def _pulled_medications(client, cursor):
+    return [medication['id'] for medication in client.get(f'/api/sync?cursor={cursor}').get_json()['medications']]
+
+
+def test_single_dose_decrements_stock_and_marks_the_medication_changed(session, client, make_medication):
+    medication = make_medication()
+    cursor = client.get('/api/sync').get_json()['cursor']
+    assert _pulled_medications(client, cursor) == []
+
+    response = client.post(f'/log_consumption/{medication.id}', data={'quantity': 2, 'status': 'taken'})
+    assert response.status_code == 302
+
+    session.expire_all()
+    assert medication.current_stock == 8
+    assert Consumption.query.filter_by(medication_id=medication.id).one().quantity == 2
+    # The stock change reaches sync clients in their next pull
+    assert _pulled_medications(client, cursor) == [medication.id]
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/log_consumption/bulk', lambda m: {'items': [{'medication_id': m.id, 'quantity': 2}]}),
+    ('/api/sync', lambda m: {'events': [{
+        'idempotency_key': 'k1', 'medication_id': m.id, 'quantity': 2,
+        'taken_at': '2026-06-01T08:00:00Z'
+    }]})
+])
+def test_batched_doses_mark_the_medication_changed(session, client, make_medication, path, payload):
+    medication = make_medication()
+    cursor = client.get('/api/sync').get_json()['cursor']
+
+    response = client.post(path, json=payload(medication))
+    assert response.status_code == 200
+
+    session.expire_all()
+    assert medication.current_stock == 8
+    assert _pulled_medications(client, cursor) == [medication.id]
@@ -0,0 +1,20 @@
+"""History page rendering and filter validation."""
+from datetime import datetime
+from models import Consumption
+
+
+def test_event_times_are_shown_in_the_users_zone(session, client, make_medication):
+    medication = make_medication()
+    # 23:30 UTC is 01:30 the next morning in Berlin summer time
+    session.add(Consumption(medication_id=medication.id, taken_at=datetime(2026, 7, 1, 23, 30), quantity=1))
+    session.commit()
+
+    response = client.get('/history')
+    assert response.status_code == 200
+    assert b'2026-07-02 01:30' in response.data
+    assert b'2026-07-01 23:30' not in response.data
+
+
+def test_dates_at_the_end_of_the_calendar_are_rejected(client):
+    assert client.get('/history?end=9999-12-31').status_code == 400
+    assert client.get('/history?start=0001-01-01').status_code == 400
@@ -0,0 +1,54 @@
+"""Medication import validation and COPY loading."""
+import io
+from datetime import datetime, time
+from openpyxl import Workbook
+from werkzeug.datastructures import FileStorage
+from importer import import_medications
+from models import Medication
+
+FREQUENCIES = ['daily', 'twice_daily', 'weekly']
+
+
+def test_out_of_range_stock_rejects_only_that_row(session, user):
+    upload = FileStorage(io.BytesIO(
+        b'name,dosage,frequency,current_stock\n'
+        b'Aspirin,100mg,daily,30\n'
+        b'Huge,1mg,daily,1e12\n'
+        b'Endless,1mg,daily,inf\n'
+        b'Largest,1mg,daily,2147483647\n'
+    ), filename='medications.csv')
+
+    imported, errors = import_medications(user.id, upload, FREQUENCIES)
+    session.commit()
+
+    assert imported == 2
+    assert errors == [
+        (3, 'Current Stock must be at most 2147483647'),
+        (4, 'Current Stock must be a whole number')
+    ]
+    stock = {m.name: m.current_stock for m in Medication.query.filter_by(user_id=user.id)}
+    assert stock == {'Aspirin': 30, 'Largest': 2147483647}
+
+
+def test_xlsx_time_cells_and_fractional_numbers(session, user):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['name', 'dosage', 'frequency', 'current_stock', 'scheduled_time', 'max_daily_doses'])
+    sheet.append(['Aspirin', '100mg', 'daily', 30, time(8, 0), 1])
+    sheet.append(['Ibuprofen', '200mg', 'twice_daily', 20.0, datetime(2026, 1, 1, 20, 30), None])
+    sheet.append(['Half', '1mg', 'daily', 5.7, time(9, 0), 1])
+    sheet.append(['Halves', '1mg', 'daily', 5, time(9, 0), 1.5])
+    data = io.BytesIO()
+    workbook.save(data)
+    data.seek(0)
+
+    imported, errors = import_medications(user.id, FileStorage(data, filename='medications.xlsx'), FREQUENCIES)
+    session.commit()
+
+    assert imported == 2
+    assert errors == [
+        (4, 'Current Stock must be a whole number'),
+        (5, 'Maximum Daily Doses must be a whole number')
+    ]
+    medications = {m.name: (m.current_stock, m.scheduled_time) for m in Medication.query.filter_by(user_id=user.id)}
+    assert medications == {'Aspirin': (30, '08:00'), 'Ibuprofen': (20, '20:30')}
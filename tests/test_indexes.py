@@ -0,0 +1,88 @@
+"""The hot-path queries from migration 0003 are planned on their named indexes."""
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from models import User, Medication, Consumption, InventoryLog, Prescription, DailyConsumptionRollup
+
+NOW = datetime(2026, 10, 1, 12, 0)
+
+
+@pytest.fixture
+def history(session, user, make_medication):
+    """A second user plus enough rows in every table for the planner to have a choice"""
+    other = User(username='bob', email='bob@example.com', password_hash='x')
+    session.add(other)
+    session.flush()
+    for owner in (user, other):
+        for i in range(20):
+            medication = make_medication(f'Medication {i:02d}', owner=owner)
+            for day in range(30):
+                taken_at = NOW - timedelta(days=day)
+                session.add(Consumption(
+                    medication_id=medication.id, taken_at=taken_at, quantity=1, status='taken'
+                ))
+                session.add(InventoryLog(
+                    medication_id=medication.id, quantity_change=-1,
+                    operation_type='remove', timestamp=taken_at
+                ))
+                session.add(DailyConsumptionRollup(
+                    user_id=owner.id, medication_id=medication.id, day=taken_at.date(),
+                    status='taken', quantity=1, dose_count=1
+                ))
+            session.add(Prescription(
+                medication_id=medication.id, file_name='rx.pdf', file_path='rx.pdf',
+                expiry_date=NOW + timedelta(days=i * 10)
+            ))
+    session.commit()
+    session.execute(text('ANALYZE'))
+    return user.medications[0]
+
+
+def _plan(session, statement):
+    compiled = statement.compile(dialect=postgresql.dialect())
+    # The tables are tiny, so rule out sequential scans and check only that
+    # the named index is usable for the query
+    session.execute(text('SET LOCAL enable_seqscan = off'))
+    rows = session.connection().exec_driver_sql(f'EXPLAIN {compiled}', compiled.params).all()
+    return '\n'.join(row[0] for row in rows)
+
+
+QUERIES = {
+    'ix_medication_user_id_name': lambda medication: (
+        select(Medication)
+        .where(Medication.user_id == medication.user_id)
+        .order_by(Medication.name)
+    ),
+    'ix_consumption_medication_id_taken_at': lambda medication: (
+        select(Consumption)
+        .where(
+            Consumption.medication_id == medication.id,
+            Consumption.taken_at >= NOW - timedelta(days=7),
+            Consumption.taken_at < NOW
+        )
+    ),
+    'ix_inventory_log_medication_id_timestamp': lambda medication: (
+        select(InventoryLog)
+        .where(InventoryLog.medication_id == medication.id)
+        .order_by(InventoryLog.timestamp.desc())
+    ),
+    'ix_prescription_expiry_date': lambda medication: (
+        select(Prescription)
+        .where(Prescription.expiry_date >= NOW, Prescription.expiry_date < NOW + timedelta(days=30))
+    ),
+    'ix_daily_consumption_rollup_user_id_day': lambda medication: (
+        select(DailyConsumptionRollup)
+        .where(
+            DailyConsumptionRollup.user_id == medication.user_id,
+            DailyConsumptionRollup.day >= date(2026, 9, 24),
+            DailyConsumptionRollup.day < date(2026, 10, 1)
+        )
+    )
+}
+
+
+@pytest.mark.parametrize('index_name', sorted(QUERIES))
+def test_query_uses_index(session, history, index_name):
+    plan = _plan(session, QUERIES[index_name](history))
+    assert f'Index Scan using {index_name}' in plan or f'Bitmap Index Scan on {index_name}' in plan, plan
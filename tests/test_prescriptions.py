@@ -0,0 +1,95 @@
+"""Prescription file storage."""
+import hashlib
+import io
+import os
+import uploads
+from models import Medication, Prescription, PrescriptionBlob
+from storage import blob_store
+
+
+def _add_prescription(session, medication, sha256):
+    PrescriptionBlob.acquire(sha256, 4, 'application/pdf')
+    session.add(Prescription(
+        medication_id=medication.id, file_name='rx.pdf',
+        file_path=blob_store.relative_path(sha256), blob_sha256=sha256
+    ))
+    session.commit()
+    return medication
+
+
+def test_deleting_a_medication_removes_its_unshared_file(session, client, make_medication):
+    sha256, _ = blob_store.save(io.BytesIO(b'%PDF-only'))
+    medication = _add_prescription(session, make_medication(), sha256)
+
+    response = client.post(f'/medication/{medication.id}/delete')
+    assert response.status_code == 302
+
+    session.expire_all()
+    assert session.get(Medication, medication.id) is None
+    assert session.get(PrescriptionBlob, sha256) is None
+    assert not blob_store.exists(sha256)
+
+
+def test_deleting_a_medication_keeps_a_shared_file(session, client, make_medication):
+    sha256, _ = blob_store.save(io.BytesIO(b'%PDF-shared'))
+    medication = _add_prescription(session, make_medication('Aspirin'), sha256)
+    _add_prescription(session, make_medication('Ibuprofen'), sha256)
+
+    client.post(f'/medication/{medication.id}/delete')
+
+    session.expire_all()
+    assert session.get(Medication, medication.id) is None
+    assert session.get(PrescriptionBlob, sha256).ref_count == 1
+    assert blob_store.exists(sha256)
+
+
+def _upload(client, medication, data, filename='rx.pdf'):
+    return client.post(f'/upload_prescription/{medication.id}', data={
+        'prescription_file': (io.BytesIO(data), filename),
+        'expiry_date': '2027-01-01',
+        'notes': ''
+    }, content_type='multipart/form-data')
+
+
+def _temp_files():
+    return os.listdir(os.path.join(blob_store.root, 'tmp'))
+
+
+def test_upload_is_written_once_into_the_store(client, make_medication, monkeypatch):
+    medication = make_medication()
+    # The request parser must not buffer prescription uploads anywhere else
+    monkeypatch.setattr(uploads, 'default_stream_factory', None)
+    data = b'%PDF-1.4\n' + b'x' * 100000
+
+    response = _upload(client, medication, data)
+    assert response.status_code == 302
+
+    sha256 = hashlib.sha256(data).hexdigest()
+    prescription = Prescription.query.filter_by(medication_id=medication.id).one()
+    assert prescription.blob_sha256 == sha256
+    assert prescription.blob.content_type == 'application/pdf'
+    with open(blob_store.path(sha256), 'rb') as f:
+        assert f.read() == data
+    assert _temp_files() == []
+
+
+def test_rejected_upload_leaves_no_temporary_file(client, make_medication):
+    medication = make_medication()
+
+    response = _upload(client, medication, b'MZ' + b'\0' * 4096)
+    assert response.status_code == 302
+    assert Prescription.query.count() == 0
+    assert _temp_files() == []
+
+
+def test_deleting_a_blob_removes_its_derivatives(app):
+    from thumbnails import VARIANTS, pipeline
+    sha256, _ = blob_store.save(io.BytesIO(b'\x89PNG\r\n\x1a\nderived'))
+    for variant in VARIANTS:
+        os.makedirs(os.path.dirname(pipeline.path(sha256, variant)), exist_ok=True)
+        open(pipeline.path(sha256, variant), 'wb').close()
+
+    blob_store.delete(sha256)
+
+    assert not blob_store.exists(sha256)
+    assert not any(os.path.exists(pipeline.path(sha256, variant)) for variant in VARIANTS)
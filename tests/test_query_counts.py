@@ -0,0 +1,46 @@
+"""Pages run the same number of queries however many medications a user has."""
+from datetime import datetime, timedelta
+import pytest
+from cache import bump_user_version
+from models import Consumption, InventoryLog, DailyConsumptionRollup
+
+PAGES = ['/history', '/reports', '/api/reports/series?date_range=30']
+
+
+def _add_medications(session, user, make_medication, count):
+    now = datetime.utcnow()
+    for i in range(count):
+        medication = make_medication(f'Medication {len(user.medications) + i:02d}')
+        for day in range(5):
+            taken_at = now - timedelta(days=day, hours=1)
+            session.add(Consumption(
+                medication_id=medication.id, taken_at=taken_at, quantity=1,
+                scheduled_time='08:00', status='taken'
+            ))
+            session.add(InventoryLog(
+                medication_id=medication.id, quantity_change=-1,
+                operation_type='remove', timestamp=taken_at
+            ))
+            session.add(DailyConsumptionRollup(
+                user_id=user.id, medication_id=medication.id, day=taken_at.date(),
+                status='taken', quantity=1, dose_count=1
+            ))
+    session.commit()
+    bump_user_version(user.id)
+
+
+def _count(client, queries, url):
+    del queries[:]
+    response = client.get(url)
+    assert response.status_code == 200
+    return len(queries)
+
+
+@pytest.mark.parametrize('url', PAGES)
+def test_query_count_does_not_grow_with_medications(session, user, client, queries, make_medication, url):
+    _add_medications(session, user, make_medication, 2)
+    few = _count(client, queries, url)
+    _add_medications(session, user, make_medication, 18)
+    many = _count(client, queries, url)
+    assert many == few, f'{url}: {few} queries with 2 medications, {many} with 20'
+    assert many <= 5
@@ -0,0 +1,98 @@
+"""Offline dose sync."""
+from datetime import datetime, timedelta, timezone
+from models import User, Consumption
+
+
+def _event(medication, key='dose-1', taken_at='2026-06-01T08:00:00Z'):
+    return {'idempotency_key': key, 'medication_id': medication.id, 'quantity': 1, 'taken_at': taken_at}
+
+
+def _statuses(response):
+    assert response.status_code == 200, response.get_json()
+    return [result['status'] for result in response.get_json()['results']]
+
+
+def test_retried_event_is_a_duplicate(session, client, make_medication):
+    medication = make_medication()
+    assert _statuses(client.post('/api/sync', json={'events': [_event(medication)]})) == ['applied']
+    assert _statuses(client.post('/api/sync', json={'events': [_event(medication)]})) == ['duplicate']
+    assert Consumption.query.count() == 1
+
+
+def test_keys_are_scoped_to_their_medication(session, client, make_medication):
+    other = User(username='bob', email='bob@example.com', password_hash='x')
+    session.add(other)
+    session.commit()
+    others_medication = make_medication(owner=other)
+    session.add(Consumption(medication_id=others_medication.id, quantity=1, idempotency_key='dose-1'))
+    session.commit()
+
+    first, second = make_medication('Aspirin'), make_medication('Ibuprofen')
+    events = [_event(first), _event(second), _event(first)]
+    assert _statuses(client.post('/api/sync', json={'events': events})) == ['applied', 'applied', 'duplicate']
+    assert Consumption.query.filter_by(idempotency_key='dose-1').count() == 3
+
+
+def test_invalid_cursor_is_rejected_before_events_are_applied(session, client, make_medication):
+    medication = make_medication()
+    response = client.post('/api/sync', json={'cursor': 'not-a-cursor', 'events': [_event(medication)]})
+    assert response.status_code == 400
+    assert Consumption.query.count() == 0
+
+
+def test_rows_committed_late_are_not_skipped(app, session, client, make_medication):
+    from app import db
+    medication = make_medication()
+    cursor = client.get('/api/sync').get_json()['cursor']
+
+    # A slow transaction takes the lower id but commits after a faster one
+    with app.app_context():
+        slow = db.engine.connect()
+        transaction = slow.begin()
+        slow.execute(Consumption.__table__.insert().values(medication_id=medication.id, quantity=1))
+
+        response = client.post('/api/sync', json={'cursor': cursor, 'events': [_event(medication, 'fast')]})
+        pulled = response.get_json()
+        assert [row['idempotency_key'] for row in pulled['consumptions']] == ['fast']
+
+        transaction.commit()
+        slow.close()
+
+    pulled = client.get(f"/api/sync?cursor={pulled['cursor']}").get_json()
+    keys = [row['idempotency_key'] for row in pulled['consumptions']]
+    assert None in keys
+
+
+def test_cursor_moves_past_rows_once_they_are_stable(session, client, make_medication):
+    medication = make_medication()
+    client.post('/api/sync', json={'events': [_event(medication)]})
+
+    first = client.get('/api/sync').get_json()
+    assert len(first['consumptions']) == 1 and len(first['medications']) == 1
+    second = client.get(f"/api/sync?cursor={first['cursor']}").get_json()
+    assert second['consumptions'] == [] and second['medications'] == []
+
+
+def test_bad_events_are_rejected_without_failing_the_batch(session, user, client, make_medication):
+    # West of UTC, the first instant of the calendar falls on a local day before it
+    user.timezone = 'America/New_York'
+    medication = make_medication()
+    events = [
+        {**_event(medication, 'huge'), 'quantity': 2 ** 31},
+        _event(medication, 'min-offset', taken_at='0001-01-01T00:00:00+05:00'),
+        _event(medication, 'min-local', taken_at='0001-01-01T00:00:00Z'),
+        _event(medication, 'valid')
+    ]
+    response = client.post('/api/sync', json={'events': events})
+    assert _statuses(response) == ['invalid', 'invalid', 'invalid', 'applied']
+    assert Consumption.query.one().idempotency_key == 'valid'
+
+
+def test_small_clock_skew_is_accepted(client, make_medication):
+    medication = make_medication()
+    now = datetime.now(timezone.utc)
+    events = [
+        _event(medication, 'fast-clock', taken_at=(now + timedelta(seconds=30)).isoformat()),
+        _event(medication, 'future', taken_at=(now + timedelta(hours=1)).isoformat())
+    ]
+    assert _statuses(client.post('/api/sync', json={'events': events})) == ['applied', 'invalid']
@@ -0,0 +1,99 @@
+"""Downsized, metadata-free derivatives of prescription images.
+
+Phone photos are several megabytes; pages only ever need a small thumbnail
+or a screen-sized copy. Both are generated by a small worker pool right
+after an upload commits, and on demand if a request arrives first. They are
+cached next to the blob store under the image's content hash, so identical
+uploads share their derivatives too. Re-encoding drops EXIF, including GPS
+position, after applying its orientation.
+"""
+import logging
+import os
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from storage import blob_store
+
+logger = logging.getLogger(__name__)
+
+# name: (longest side in pixels, Pillow format, extension, mimetype, save options)
+VARIANTS = {
+    'thumb': (320, 'WEBP', 'webp', 'image/webp', {'quality': 75, 'method': 4}),
+    'display': (1600, 'JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+
+
+class ThumbnailPipeline:
+    """Generates derivatives in background threads, never the same one twice at once"""
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get('THUMBNAIL_WORKERS', self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnails')
+
+    def path(self, sha256, variant):
+        ext = VARIANTS[variant][2]
+        return os.path.join(blob_store.root, 'derived', sha256[:2], f'{sha256}.{variant}.{ext}')
+
+    def schedule(self, sha256):
+        """Queue every derivative of a stored image that is not on disk yet"""
+        for variant in VARIANTS:
+            if not os.path.exists(self.path(sha256, variant)):
+                self._submit(sha256, variant)
+
+    def get(self, sha256, variant):
+        """Return the path of a derivative, generating it first if needed"""
+        path = self.path(sha256, variant)
+        if not os.path.exists(path):
+            self._submit(sha256, variant).result()
+        return path
+
+    def _submit(self, sha256, variant):
+        key = (sha256, variant)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._generate, sha256, variant)
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+            return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _generate(self, sha256, variant):
+        size, image_format, _, _, options = VARIANTS[variant]
+        path = self.path(sha256, variant)
+        try:
+            with Image.open(blob_store.path(sha256)) as image:
+                # For JPEGs, decode at a reduced scale close to the target
+                # size instead of decompressing every pixel
+                image.draft('RGB', (size, size))
+                image = ImageOps.exif_transpose(image)
+                image = image.convert('RGB')
+                image.thumbnail((size, size), Image.LANCZOS)
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        # No exif or icc_profile passed, so none is written
+                        image.save(f, image_format, **options)
+                    os.replace(temp_path, path)
+                except BaseException:
+                    os.remove(temp_path)
+                    raise
+        except Exception as e:
+            logger.error(f"Failed to generate {variant} for blob {sha256}: {str(e)}")
+            raise
+        return path
+
+
+pipeline = ThumbnailPipeline()
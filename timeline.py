@@ -0,0 +1,114 @@
+"""Merged, keyset-paginated history of inventory changes and doses.
+
+Both event tables are read through one UNION ALL query. Each branch applies
+the filters and the page cursor itself and is limited to one page, so a page
+costs two short index scans whatever the length of the history.
+"""
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import literal, select, tuple_, union_all
+from app import db
+from models import Medication, Consumption, InventoryLog
+from pagination import encode_cursor, decode_cursor
+from timeutils import local_midnight_utc
+
+EVENT_TYPES = ('consumption', 'inventory')
+PAGE_SIZE = 50
+
+TimelineFilters = namedtuple(
+    'TimelineFilters',
+    ['medication_id', 'event_type', 'start_day', 'end_day', 'start_utc', 'end_utc']
+)
+
+
+def parse_timeline_filters(args, zone):
+    """Read history filters from a query string; raises ValueError on malformed input"""
+    medication_id = args.get('medication_id', '')
+    medication_id = int(medication_id) if medication_id else None
+
+    event_type = args.get('event_type') or None
+    if event_type is not None and event_type not in EVENT_TYPES:
+        raise ValueError(f'Unknown event type: {event_type}')
+
+    start_day = date.fromisoformat(args['start']) if args.get('start') else None
+    end_day = date.fromisoformat(args['end']) if args.get('end') else None
+    try:
+        start_utc = local_midnight_utc(start_day, zone) if start_day else None
+        end_utc = local_midnight_utc(end_day + timedelta(days=1), zone) if end_day else None
+    except OverflowError:
+        # Days at the ends of the calendar have no midnight in every zone
+        raise ValueError('Date range is out of bounds')
+    return TimelineFilters(medication_id, event_type, start_day, end_day, start_utc, end_utc)
+
+
+def _branch(event_type, model, occurred_at, quantity, detail, user_id, filters, position):
+    query = (
+        select(
+            literal(event_type).label('event_type'),
+            model.id.label('id'),
+            model.medication_id.label('medication_id'),
+            occurred_at.label('occurred_at'),
+            quantity.label('quantity'),
+            detail.label('detail')
+        )
+        .join(Medication, model.medication_id == Medication.id)
+        .where(Medication.user_id == user_id)
+    )
+    if filters.medication_id:
+        query = query.where(model.medication_id == filters.medication_id)
+    if filters.start_utc:
+        query = query.where(occurred_at >= filters.start_utc)
+    if filters.end_utc:
+        query = query.where(occurred_at < filters.end_utc)
+
+    if position:
+        # Rows sort by (occurred_at, event_type, id) descending; event_type is
+        # constant within a branch, so the cursor reduces to a range on the
+        # branch's own (occurred_at, id)
+        last_at, last_type, last_id = position
+        if event_type < last_type:
+            query = query.where(occurred_at <= last_at)
+        elif event_type == last_type:
+            query = query.where(tuple_(occurred_at, model.id) < tuple_(last_at, last_id))
+        else:
+            query = query.where(occurred_at < last_at)
+
+    return query.order_by(occurred_at.desc(), model.id.desc())
+
+
+def get_timeline_page(user_id, filters, cursor=None, limit=PAGE_SIZE):
+    """Return one page of history events, newest first, and the cursor for the next page"""
+    position = None
+    if cursor:
+        position = decode_cursor(cursor, datetime, str, int)
+        if position is None:
+            raise ValueError('Invalid cursor')
+
+    branches = []
+    if filters.event_type in (None, 'consumption'):
+        branches.append(_branch(
+            'consumption', Consumption, Consumption.taken_at, Consumption.quantity,
+            Consumption.status, user_id, filters, position
+        ))
+    if filters.event_type in (None, 'inventory'):
+        branches.append(_branch(
+            'inventory', InventoryLog, InventoryLog.timestamp, InventoryLog.quantity_change,
+            InventoryLog.operation_type, user_id, filters, position
+        ))
+
+    pages = [select(branch.limit(limit + 1).subquery()) for branch in branches]
+    events = (union_all(*pages) if len(pages) > 1 else pages[0]).subquery()
+
+    rows = db.session.execute(
+        select(events, Medication.name.label('medication_name'), Medication.dosage.label('dosage'))
+        .join(Medication, Medication.id == events.c.medication_id)
+        .order_by(events.c.occurred_at.desc(), events.c.event_type.desc(), events.c.id.desc())
+        .limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.occurred_at, last.event_type, last.id)
+    return rows, next_cursor
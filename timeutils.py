@@ -0,0 +1,43 @@
+"""Conversions between stored UTC timestamps and users' local calendars.
+
+Timestamps are stored as naive UTC datetimes; reports and daily counts are
+expressed in the user's own time zone.
+"""
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+DEFAULT_TIMEZONE = 'UTC'
+
+
+def get_zone(name):
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def timezone_choices():
+    return [(name, name) for name in sorted(available_timezones())]
+
+
+def to_local(utc_naive, zone):
+    return utc_naive.replace(tzinfo=timezone.utc).astimezone(zone)
+
+
+def local_today(zone):
+    return datetime.now(zone).date()
+
+
+def local_day(utc_naive, zone):
+    """Return the user's calendar day for a stored UTC timestamp"""
+    return to_local(utc_naive, zone).date()
+
+
+def local_midnight_utc(day, zone):
+    """Return the naive UTC timestamp of local midnight at the start of a day"""
+    return datetime.combine(day, time.min, tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def local_day_bounds(start_day, end_day, zone):
+    """Return the half-open naive UTC range [start, end) covering local days start_day..end_day"""
+    return local_midnight_utc(start_day, zone), local_midnight_utc(end_day + timedelta(days=1), zone)
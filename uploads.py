@@ -0,0 +1,111 @@
+"""Early validation of prescription uploads while they stream in.
+
+Werkzeug writes each uploaded file into a stream obtained from
+Request._get_file_stream. For the prescription upload endpoint that stream
+checks the file's magic bytes as soon as the first chunk arrives and counts
+bytes as they are written, so a mistyped upload is rejected with 415 and an
+oversized one with 413 before the rest of the body is stored. Accepted
+bytes go straight into a blob store temporary file, hashed on the way, so
+the view only has to move the finished file into place.
+"""
+import logging
+from flask import Request, abort
+from werkzeug.formparser import default_stream_factory
+from storage import blob_store
+
+try:
+    import magic
+except ImportError:
+    magic = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Largest accepted file per detected type
+MAX_SIZES = {
+    'image/jpeg': 15 * MB,
+    'image/png': 15 * MB,
+    'application/pdf': 20 * MB
+}
+VALIDATED_ENDPOINTS = {'main.upload_prescription'}
+# Enough for libmagic to identify every accepted type
+SNIFF_BYTES = 2048
+
+# Used when libmagic is not installed
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'%PDF-', 'application/pdf')
+)
+
+
+def sniff_type(head):
+    """Return the MIME type identified by a file's first bytes"""
+    if magic is not None:
+        return magic.from_buffer(head, mime=True)
+    for signature, mimetype in SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    return 'application/octet-stream'
+
+
+class ValidatingStream:
+    """Writable file stream that rejects the upload once its type or size is wrong"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._head = b''
+        self.size = 0
+        self.detected_type = None
+        self.max_size = max(MAX_SIZES.values())
+
+    def _reject(self, code):
+        # The parser drops the stream without closing it, so discard what
+        # was written so far here
+        self._stream.close()
+        abort(code)
+
+    def _sniff(self):
+        self.detected_type = sniff_type(self._head)
+        if self.detected_type not in MAX_SIZES:
+            logger.warning(f"Rejected prescription upload of type {self.detected_type}")
+            self._reject(415)
+        self.max_size = MAX_SIZES[self.detected_type]
+        self._head = b''
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            self._reject(413)
+        if self.detected_type is None:
+            self._head += data
+            if len(self._head) >= SNIFF_BYTES:
+                self._sniff()
+        return self._stream.write(data)
+
+    def seek(self, *args):
+        # The parser rewinds once the file is complete; short files are
+        # identified here
+        if self.detected_type is None:
+            self._sniff()
+        return self._stream.seek(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+
+class UploadRequest(Request):
+    """Request class that validates uploads to the prescription endpoint as they arrive"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in VALIDATED_ENDPOINTS:
+            return ValidatingStream(blob_store.writer())
+        return default_stream_factory(
+            total_content_length=total_content_length,
+            content_type=content_type,
+            filename=filename,
+            content_length=content_length
+        )